@@ -2,11 +2,13 @@ import os
 import logging
 import torch
 import torch.distributed as dist
-from transformers import AutoTokenizer, TextStreamer
+from transformers import AutoTokenizer
 from tpi_llm import TPILlamaForCausalLM
-from tpi_llm.split import split_pretrained_model
+from tpi_llm.split import split_pretrained_model, split_pretrained_model_for_node
 from tpi_llm.modeling_utils import load_model_config
-from tpi_llm.distributed import run_sync_server, download_file
+from tpi_llm.generation.streamers import BatchedTextStreamer
+from tpi_llm.cache_utils import TPIQuantizedCache
+from tpi_llm.distributed import run_sync_server, download_file, sync_model_files
 
 
 logging.basicConfig(
@@ -41,7 +43,20 @@ def main(my_rank, world_size, args):
     # split and synchronize pretrained model weights
     args.ratio = [1./args.world_size] * args.world_size  # todo: the decision of ratio should be optimized.
     split_file_path = os.path.join(args.model_path, args.save_dir)
-    if my_rank == 0:
+    if args.shared_fs:
+        # each node reads its own slices from the model files on the shared file system in parallel.
+        if not os.path.exists(os.path.join(split_file_path, f"node_{my_rank}")) or args.split_bin:
+            split_pretrained_model_for_node(
+                model_path=args.model_path,
+                world_size=world_size,
+                ratio=args.ratio,
+                rank=my_rank,
+                save_dir=args.save_dir,
+                compress=args.compress_bin,
+                quantize=args.load_int8,
+            )
+            logger.info(f"Weights of node {my_rank} are splitted and saved to {split_file_path}.")
+    elif my_rank == 0:
         if not os.path.exists(args.model_path):
             raise Exception(f"Model path {args.model_path} does not exist, "
                             f"please download the pretrained model parameters first.")
@@ -52,21 +67,30 @@ def main(my_rank, world_size, args):
                 model_path=args.model_path,
                 world_size=world_size,
                 ratio=args.ratio,
-                save_dir=args.save_dir
+                save_dir=args.save_dir,
+                compress=args.compress_bin,
+                quantize=args.load_int8,
             )
             logger.info(f"All weights are splitted and saved to {split_file_path}.")
 
-        # wait for other nodes to download sliced files.
-        run_sync_server(args.master_ip, args.file_port, args.model_path, split_file_path)
-
-        # ensure that the file download is executed after the master node binds its file port.
-        dist.barrier()
+        if args.dist_sync:
+            # send sliced files to other nodes with collective communication.
+            sync_model_files(my_rank, args.model_path, split_file_path)
+        else:
+            # wait for other nodes to download sliced files.
+            run_sync_server(args.master_ip, args.file_port, args.model_path, split_file_path)
+
+            # ensure that the file download is executed after the master node binds its file port.
+            dist.barrier()
+    elif args.dist_sync:
+        # receive sliced weight files from the master node with collective communication.
+        sync_model_files(my_rank, args.model_path, split_file_path, force=args.force_download)
     else:
         dist.barrier()
         # each node download sliced weight files from the master node.
         if not os.path.exists(split_file_path) or args.force_download:
-            os.makedirs(os.path.join(split_file_path, f"node_{my_rank}"), exist_ok=True)
-            download_file(args.master_ip, args.file_port, my_rank, split_file_path)
+            download_file(args.master_ip, args.file_port, my_rank, args.model_path,
+                          skip_existing=not args.force_download)
 
     # load model configurations
     model_config = load_model_config(args.model_path)
@@ -87,11 +111,11 @@ def main(my_rank, world_size, args):
     tokenizer, streamer = None, None
     input_ids = ""
     if my_rank == 0:
-        tokenizer = tokenizer_class.from_pretrained(args.model_path)
+        tokenizer = tokenizer_class.from_pretrained(args.model_path, use_fast=True)
         if tokenizer.pad_token is None:
             tokenizer.pad_token = tokenizer.eos_token
 
-        streamer = TextStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        streamer = BatchedTextStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
 
         prompt_text = args.prompt if args.prompt else input("User prompt >>> ")
         input_ids = tokenizer.encode(
@@ -112,6 +136,8 @@ def main(my_rank, world_size, args):
         top_p=args.p,
         do_sample=True,
         streamer=streamer,
+        past_key_values=TPIQuantizedCache() if args.kv_int8 else None,
+        cache_implementation="static" if args.static_kv else None,
     )
 
     # print recorded memory usage
@@ -16,10 +16,23 @@ if __name__ == "__main__":
     parser.add_argument("--use_gpu", action="store_true", help="Whether to use gpu, default to use cpu.")
     parser.add_argument("--split_bin", action="store_true", help="Whether to split the model file.")
     parser.add_argument("--save_dir", type=str, default="split", help="Directory to save split models.")
+    parser.add_argument("--compress_bin", action="store_true", help="Whether to compress split model files with Zstd.")
+    parser.add_argument("--load_int8", action="store_true",
+                        help="Whether to quantize split transformer weights to int8 to reduce loading bytes.")
+    parser.add_argument("--kv_int8", action="store_true",
+                        help="Whether to store the KV cache in int8 (half the memory, dequantized every step).")
+    parser.add_argument("--static_kv", action="store_true",
+                        help="Whether to preallocate the KV cache for the whole generation instead of growing it.")
+    parser.add_argument("--torch_compile", action="store_true",
+                        help="Whether to fuse the elementwise ops of decoder layers with torch.compile.")
     parser.add_argument("--seed", type=int, default=42, help="Random seed.")
     # for model synchronization
     parser.add_argument("--file_port", type=int, default=29600, help="File server port.")
     parser.add_argument("--force_download", action="store_true", help="Force download sliced model files.")
+    parser.add_argument("--dist_sync", action="store_true",
+                        help="Whether to distribute sliced model files with collective communication.")
+    parser.add_argument("--shared_fs", action="store_true",
+                        help="Whether model files are on a shared file system, so each node splits its own slices.")
     # hyperparameters
     parser.add_argument("--temperature", type=float, default=1.0)
     parser.add_argument("--k", type=int, default=0)
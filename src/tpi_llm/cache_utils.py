@@ -0,0 +1,213 @@
+import torch
+from typing import Any, Dict, List, Optional, Tuple
+from transformers import Cache
+
+
+class TPIPagedCache(Cache):
+    """
+    A key value cache whose buffers grow lazily in whole pages of `page_size` tokens. `DynamicCache` concatenates
+    the new states to the cache at every step, which reallocates and copies the whole cache for each token.
+    Here, the new states are written in place into the free space of the buffers, and the buffers of a layer
+    are only reallocated when they are full, with their capacity doubled, so that the cached states are copied
+    O(log(seq_length)) times over a generation.
+
+    The cached states of each layer are kept in buffers of shape
+    `[batch_size, num_heads, num_pages * page_size, head_dim]`, of which the first `seq_length` tokens are used.
+
+    Parameters:
+        page_size (int, optional): The number of tokens in each page. Defaults to 16.
+    """
+
+    def __init__(self, page_size: int = 16):
+        super().__init__()
+        self.page_size = page_size
+        self.key_cache: List[torch.Tensor] = []
+        self.value_cache: List[torch.Tensor] = []
+        self._seq_lengths: List[int] = []
+        self._seen_tokens = 0  # Used in `generate` to keep tally of how many tokens the cache has seen
+
+    def __len__(self):
+        """
+        Returns the number of layers in the cache.
+        """
+        return len(self.key_cache)
+
+    def _allocate(self, states: torch.Tensor, num_tokens: int) -> torch.Tensor:
+        """
+        Allocates a buffer of whole pages that holds at least num_tokens tokens of the given states.
+        """
+        num_pages = (num_tokens + self.page_size - 1) // self.page_size
+        shape = states.shape[:-2] + (num_pages * self.page_size, states.shape[-1])
+        return states.new_empty(shape)
+
+    def _write(self, buffers: List[torch.Tensor], layer_idx: int, states: torch.Tensor, start: int) -> torch.Tensor:
+        """
+        Writes the states of a layer at token position `start` into its buffer in `buffers`, allocating the
+        buffer or growing it if it is full, and returns a view of the used part of the buffer.
+        """
+        end = start + states.shape[-2]
+        if len(buffers) <= layer_idx:
+            buffers.append(self._allocate(states, end))
+        # double the capacity if the buffer is full, and move the cached states into the new buffer
+        elif end > buffers[layer_idx].shape[-2]:
+            buffer = self._allocate(states, max(end, 2 * buffers[layer_idx].shape[-2]))
+            buffer[..., :start, :].copy_(buffers[layer_idx][..., :start, :])
+            buffers[layer_idx] = buffer
+
+        buffers[layer_idx][..., start:end, :].copy_(states)
+        return buffers[layer_idx][..., :end, :]
+
+    def update(
+        self,
+        key_states: torch.Tensor,
+        value_states: torch.Tensor,
+        layer_idx: int,
+        cache_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Updates the cache with the new `key_states` and `value_states` for the layer `layer_idx`.
+
+        Parameters:
+            key_states (torch.Tensor):
+                The new key states to cache.
+            value_states (torch.Tensor):
+                The new value states to cache.
+            layer_idx (int):
+                The index of the layer to cache the states for.
+            cache_kwargs (Dict[str, Any], optional):
+                Additional arguments for the cache subclass. No additional arguments are used in `TPIPagedCache`.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Views of the cached key and value states of the layer.
+        """
+        # update the number of seen tokens
+        if layer_idx == 0:
+            self._seen_tokens += key_states.shape[-2]
+
+        if len(self._seq_lengths) <= layer_idx:
+            self._seq_lengths.append(0)
+
+        start = self._seq_lengths[layer_idx]
+        keys, values = self._write_states(layer_idx, key_states, value_states, start)
+        self._seq_lengths[layer_idx] = start + key_states.shape[-2]
+        return keys, values
+
+    def _write_states(
+        self, layer_idx: int, key_states: torch.Tensor, value_states: torch.Tensor, start: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Writes the new key and value states of a layer at token position `start`, and returns the cached key
+        and value states of the layer.
+        """
+        keys = self._write(self.key_cache, layer_idx, key_states, start)
+        values = self._write(self.value_cache, layer_idx, value_states, start)
+        return keys, values
+
+    def get_seq_length(self, layer_idx: Optional[int] = 0) -> int:
+        """
+        Returns the sequence length of the cached states. A layer index can be optionally passed.
+        """
+        if len(self._seq_lengths) <= layer_idx:
+            return 0
+        return self._seq_lengths[layer_idx]
+
+    def get_max_length(self) -> Optional[int]:
+        """
+        Returns the maximum sequence length of the cached states. `TPIPagedCache` does not have a maximum length.
+        """
+        return None
+
+
+class TPIQuantizedCache(TPIPagedCache):
+    """
+    A `TPIPagedCache` that stores the key and value states in int8, which halves the memory footprint of
+    the cache compared to float16. Each token of each head is quantized with its own absmax scale over
+    `head_dim`, so outliers in one head do not affect the precision of the others. The cached states are
+    dequantized to the dtype of the new states when they are returned to the attention layer.
+
+    Note that this trades speed for capacity: the resting cache is halved, but each step dequantizes the
+    whole cache of a layer, which reads the int8 cache and writes and reads a float copy of it. The float
+    copies are written into two scratch buffers shared by all layers, as layers run one after another, so
+    they only take the memory of one layer and are not reallocated at each step. Use it when the cache does
+    not fit in memory, not to speed up attention.
+
+    The scales of each layer are kept in buffers of shape `[batch_size, num_heads, num_pages * page_size, 1]`.
+
+    Parameters:
+        page_size (int, optional): The number of tokens in each page. Defaults to 16.
+    """
+
+    def __init__(self, page_size: int = 16):
+        super().__init__(page_size)
+        self.key_scales: List[torch.Tensor] = []
+        self.value_scales: List[torch.Tensor] = []
+        self._scratch: List[Optional[torch.Tensor]] = [None, None]
+
+    @staticmethod
+    def _quantize(states: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Quantizes the states to int8 with a scale for each token of each head.
+        """
+        scale = (states.abs().amax(dim=-1, keepdim=True).float() / 127).clamp_(min=1e-8)
+        q = (states.float() / scale).round_().clamp_(-127, 127).to(torch.int8)
+        return q, scale.to(states.dtype)
+
+    def _dequantize(self, slot: int, q: torch.Tensor, scale: torch.Tensor, capacity: int) -> torch.Tensor:
+        """
+        Dequantizes the cached states of a layer into the scratch buffer `slot`, which is reallocated with
+        `capacity` tokens only if it is too small, and returns a view of the used part of it.
+        """
+        buffer = self._scratch[slot]
+        if (buffer is None or buffer.shape[:-2] != q.shape[:-2] or buffer.shape[-2] < q.shape[-2]
+                or buffer.dtype != scale.dtype or buffer.device != q.device):
+            self._scratch[slot] = None
+            del buffer
+            buffer = scale.new_empty(q.shape[:-2] + (capacity, q.shape[-1]))
+            self._scratch[slot] = buffer
+        out = buffer[..., :q.shape[-2], :]
+        return torch.mul(q, scale, out=out)
+
+    def _write_states(
+        self, layer_idx: int, key_states: torch.Tensor, value_states: torch.Tensor, start: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Quantizes and writes the new key and value states of a layer at token position `start`, and returns
+        the dequantized cached key and value states of the layer.
+        """
+        key_q, key_scale = self._quantize(key_states)
+        value_q, value_scale = self._quantize(value_states)
+        key_q = self._write(self.key_cache, layer_idx, key_q, start)
+        key_scale = self._write(self.key_scales, layer_idx, key_scale, start)
+        value_q = self._write(self.value_cache, layer_idx, value_q, start)
+        value_scale = self._write(self.value_scales, layer_idx, value_scale, start)
+
+        # the scratch buffers take the capacity of the int8 buffers, so they grow as rarely as those
+        capacity = self.key_cache[layer_idx].shape[-2]
+        return self._dequantize(0, key_q, key_scale, capacity), self._dequantize(1, value_q, value_scale, capacity)
+
+
+class TPIStaticCache(TPIPagedCache):
+    """
+    A `TPIPagedCache` whose buffers are preallocated for `max_cache_len` tokens when a layer is cached for the
+    first time, so that the key and value states of each layer stay in one contiguous buffer which is written
+    in place and never reallocated during generation. If more than `max_cache_len` tokens are cached, the
+    buffers grow as in `TPIPagedCache`.
+
+    As the whole cache is reserved before the first token, this is only used when `generate` is called with
+    `cache_implementation="static"`. The default `TPIPagedCache` only holds the tokens cached so far, which
+    suits memory-constrained devices better.
+
+    Parameters:
+        max_cache_len (int): The number of tokens to preallocate the cache for.
+        page_size (int, optional): The number of tokens in each page beyond `max_cache_len`. Defaults to 16.
+    """
+
+    def __init__(self, max_cache_len: int, page_size: int = 16):
+        super().__init__(page_size)
+        self.max_cache_len = max_cache_len
+
+    def _allocate(self, states: torch.Tensor, num_tokens: int) -> torch.Tensor:
+        """
+        Allocates a buffer that holds at least max_cache_len tokens of the given states.
+        """
+        return super()._allocate(states, max(num_tokens, self.max_cache_len))
@@ -1,2 +1,2 @@
 from .comm import DistributedCommPrimitive
-from .model_sync import run_sync_server, download_file
+from .model_sync import run_sync_server, download_file, sync_model_files
@@ -1,6 +1,6 @@
 import torch
 import torch.distributed as dist
-from typing import List, Union
+from typing import List, Optional, Union
 from torch._C._distributed_c10d import ReduceOp
 
 
@@ -22,6 +22,29 @@ class DistributedCommPrimitive:
         """
         dist.broadcast_object_list(object_list, src=src)
 
+    @classmethod
+    def broadcast_tensor(
+        cls,
+        tensor: torch.Tensor,
+        src: int,
+        async_op=False
+    ) -> Union[dist.distributed_c10d.Work, None]:
+        """
+        Broadcast a tensor from the source node to all other nodes. Unlike `broadcast`, the tensor is sent
+        without pickling, but all other nodes need to know its shape and dtype to allocate it beforehand.
+
+        Args:
+            tensor (torch.Tensor): The tensor to be sent on the source node, or to receive into on other nodes.
+            src (int): The rank of the source node.
+            async_op (bool, optional): If True, the operation will be performed asynchronously, and a
+            `dist.distributed_c10d.Work` object will be returned (default is False).
+
+        Returns:
+            Union[dist.distributed_c10d.Work, None]: Returns a `Work` object if `async_op` is True;
+            otherwise, returns None.
+        """
+        return dist.broadcast(tensor, src=src, async_op=async_op)
+
     # todo(lizh): optimize the communication efficiency
     @classmethod
     def allreduce(
@@ -45,3 +68,21 @@ class DistributedCommPrimitive:
             otherwise, returns None.
         """
         return dist.all_reduce(tensor, op=op, async_op=async_op)
+
+    @classmethod
+    def gather(
+        cls,
+        tensor: torch.Tensor,
+        gather_list: Optional[List[torch.Tensor]],
+        dst: int
+    ):
+        """
+        Gather tensors of the same shape from all nodes to the destination node.
+
+        Args:
+            tensor (torch.Tensor): The tensor to be sent from this node.
+            gather_list (List[torch.Tensor], optional): A list of tensors to receive into, one for each node,
+            on the destination node, and None on other nodes.
+            dst (int): The rank of the destination node.
+        """
+        dist.gather(tensor, gather_list=gather_list, dst=dst)
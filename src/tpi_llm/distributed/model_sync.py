@@ -1,10 +1,14 @@
 import os
+import json
 import struct
 import logging
 import socket
 import threading
-from typing import List
+import torch
+import torch.distributed as dist
+from typing import Dict, List, Tuple
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from ..utils import FILES_TO_SYNC
 
 logging.basicConfig(
@@ -14,50 +18,128 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+REQUEST_MANIFEST = 0
+REQUEST_CHUNK = 1
+DOWNLOAD_CONCURRENCY = 8
+DOWNLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+SOCKET_BUFFER_SIZE = 1024 * 1024
+PARTIAL_DOWNLOAD_SUFFIX = ".part"
 
-def download_file(host: str, port: int, rank: int, save_path: str):
+
+def _recv_exact(conn: socket.socket, size: int) -> bytes:
+    """
+    Receive exactly <size> bytes from a connection.
+
+    Args:
+        conn (socket.socket): The connection socket.
+        size (int): The number of bytes to receive.
+
+    Returns:
+        bytes: The received bytes.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    bytes_received = 0
+    while bytes_received < size:
+        n = conn.recv_into(view[bytes_received:], size - bytes_received)
+        if n == 0:
+            raise ConnectionError("Connection closed by the file server.")
+        bytes_received += n
+    return bytes(buffer)
+
+
+def _request_manifest(host: str, port: int, rank: int) -> List[Tuple[str, int]]:
     """
-    Connect to the file server on the master node to download sliced model parameter files.
+    Request the list of files to be downloaded by node <rank>.
 
     Args:
         host (str): The IP address or hostname of the master node.
         port (int): The port number on which the file server is listening.
         rank (int): The rank of the requesting node.
-        save_path (str): The directory where downloaded files will be saved.
-    """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        try:
-            # connect to the file server
-            s.connect((host, port))
-            # send my rank to the master node
-            s.sendall(struct.pack("i", rank))
-
-            # receive the number of files to be received
-            num_files_data = s.recv(4)
-            num_files = struct.unpack("i", num_files_data)[0]
-            logger.info(f"Downloading {num_files} files from the master node.")
-
-            # download model files
-            for _ in tqdm(range(num_files), leave=True):
-                # receive file name length
-                file_name_length_data = s.recv(4)
-                file_name_length = struct.unpack('i', file_name_length_data)[0]
-                # receive file name
-                file_name = s.recv(file_name_length).decode("utf-8")
-                # receive file size
-                file_size_data = s.recv(8)
-                file_size = struct.unpack("Q", file_size_data)[0]
-                # receive file content
-                with open(os.path.join(save_path, file_name), "wb") as f:
-                    bytes_received = 0
-                    while bytes_received < file_size:
-                        data = s.recv(min(1024, file_size - bytes_received))
-                        if not data:
-                            break
-                        f.write(data)
-                        bytes_received += len(data)
-        except ConnectionRefusedError:
-            raise ConnectionRefusedError(f"Rank {rank} connected to {host}:{port} failed.")
+
+    Returns:
+        List[Tuple[str, int]]: The file paths relative to the model path, and the file sizes.
+    """
+    with socket.create_connection((host, port)) as s:
+        s.sendall(struct.pack("ii", REQUEST_MANIFEST, rank))
+        manifest_size = struct.unpack("Q", _recv_exact(s, 8))[0]
+        return [tuple(entry) for entry in json.loads(_recv_exact(s, manifest_size).decode("utf-8"))]
+
+
+def _download_chunk(host: str, port: int, rank: int, rel_path: str, file_path: str, offset: int, length: int):
+    """
+    Download a byte range of a file over a dedicated connection and write it to the same range of
+    the local file.
+
+    Args:
+        host (str): The IP address or hostname of the master node.
+        port (int): The port number on which the file server is listening.
+        rank (int): The rank of the requesting node.
+        rel_path (str): The path of the file relative to the model path.
+        file_path (str): The local file to write to.
+        offset (int): The offset of the byte range.
+        length (int): The length of the byte range.
+    """
+    file_name = rel_path.encode("utf-8")
+    with socket.create_connection((host, port)) as s, open(file_path, "r+b") as f:
+        s.sendall(struct.pack("ii", REQUEST_CHUNK, rank))
+        s.sendall(struct.pack("i", len(file_name)))
+        s.sendall(file_name)
+        s.sendall(struct.pack("QQ", offset, length))
+
+        f.seek(offset)
+        buffer = bytearray(SOCKET_BUFFER_SIZE)
+        view = memoryview(buffer)
+        bytes_received = 0
+        while bytes_received < length:
+            n = s.recv_into(view, min(SOCKET_BUFFER_SIZE, length - bytes_received))
+            if n == 0:
+                raise ConnectionError(f"Connection closed while downloading {rel_path}.")
+            f.write(view[:n])
+            bytes_received += n
+
+
+def download_file(host: str, port: int, rank: int, save_path: str, skip_existing: bool = True):
+    """
+    Connect to the file server on the master node to download sliced model parameter files. Files are
+    split into chunks, which are downloaded concurrently over multiple connections.
+
+    Args:
+        host (str): The IP address or hostname of the master node.
+        port (int): The port number on which the file server is listening.
+        rank (int): The rank of the requesting node.
+        save_path (str): The model path where downloaded files will be saved.
+        skip_existing (bool, optional): Whether to skip files that already exist with the same size.
+            Defaults to True.
+    """
+    try:
+        manifest = _request_manifest(host, port, rank)
+    except ConnectionRefusedError:
+        raise ConnectionRefusedError(f"Rank {rank} connected to {host}:{port} failed.")
+
+    # files are downloaded to temporary files first, so that partial downloads are not mistaken as complete
+    chunks, files_to_rename = [], []
+    for rel_path, file_size in manifest:
+        file_path = os.path.join(save_path, rel_path)
+        if skip_existing and os.path.exists(file_path) and os.path.getsize(file_path) == file_size:
+            continue
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        part_path = file_path + PARTIAL_DOWNLOAD_SUFFIX
+        with open(part_path, "wb") as f:
+            f.truncate(file_size)
+        files_to_rename.append((part_path, file_path))
+        for offset in range(0, file_size, DOWNLOAD_CHUNK_SIZE):
+            chunks.append((rel_path, part_path, offset, min(DOWNLOAD_CHUNK_SIZE, file_size - offset)))
+    logger.info(f"Downloading {len(files_to_rename)} files from the master node.")
+
+    # download model files
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+        futures = [executor.submit(_download_chunk, host, port, rank, *chunk) for chunk in chunks]
+        for future in tqdm(as_completed(futures), total=len(futures), leave=True):
+            future.result()
+
+    for part_path, file_path in files_to_rename:
+        os.replace(part_path, file_path)
 
 
 def run_sync_server(host: str, port: int, model_path: str, split_path: str):
@@ -70,51 +152,56 @@ def run_sync_server(host: str, port: int, model_path: str, split_path: str):
         model_path (str): The directory containing the main model files.
         split_path (str): The directory containing the split model files.
     """
-    def _get_files_to_send(rank: int):
+    def _get_files_to_send(rank: int) -> Dict[str, str]:
         """
-        Retrieve the list of files to be sent to node <rank>.
+        Retrieve the files to be sent to node <rank>.
 
         Args:
             rank (int): The rank of the requesting node.
 
         Returns:
-            List[str]: A list of file paths to be sent.
+            Dict[str, str]: A dictionary mapping file paths relative to the model path to the file paths.
         """
         files_in_dir = set(os.listdir(model_path))
         files_to_send = files_in_dir.intersection(FILES_TO_SYNC)
         node_file_path = os.path.join(split_path, f"node_{rank}")
         split_weights_in_dir = os.listdir(node_file_path)
-        return ([os.path.join(model_path, fn) for fn in files_to_send]
-                + [os.path.join(node_file_path, fn) for fn in split_weights_in_dir])
+        file_paths = ([os.path.join(model_path, fn) for fn in files_to_send]
+                      + [os.path.join(node_file_path, fn) for fn in split_weights_in_dir])
+        return {os.path.relpath(file_path, model_path): file_path for file_path in file_paths}
 
-    def _send_files(conn, files: List[str]):
+    def _send_manifest(conn, files: Dict[str, str]):
         """
-        Send selected files to a connected node.
+        Send the relative paths and sizes of selected files to a connected node.
 
         Args:
             conn (socket.socket): The connection socket to the node.
-            files (List[str]): A list of files to be sent.
+            files (Dict[str, str]): The files to be sent, keyed by their relative paths.
+        """
+        manifest = json.dumps([
+            [rel_path, os.path.getsize(file_path)] for rel_path, file_path in files.items()
+        ]).encode("utf-8")
+        conn.sendall(struct.pack("Q", len(manifest)))
+        conn.sendall(manifest)
+
+    def _send_chunk(conn, files: Dict[str, str]):
         """
-        # send the number of files
-        conn.sendall(struct.pack("i", len(files)))
-        # send each file name and content
-        for file_path in files:
-            # send file name length and file name
-            file_name = os.path.basename(file_path)
-            conn.sendall(struct.pack("i", len(file_name)))
-            conn.sendall(file_name.encode('utf-8'))
-            # send file size
-            file_size = os.path.getsize(file_path)
-            conn.sendall(struct.pack("Q", file_size))
-            # send file content
-            with open(file_path, "rb") as f:
-                bytes_read = 0
-                while bytes_read < file_size:
-                    data = f.read(min(1024, file_size - bytes_read))
-                    if not data:
-                        break
-                    conn.sendall(data)
-                    bytes_read += len(data)
+        Send a byte range of a selected file to a connected node.
+
+        Args:
+            conn (socket.socket): The connection socket to the node.
+            files (Dict[str, str]): The files allowed to be sent, keyed by their relative paths.
+        """
+        # receive file name, offset and length of the byte range
+        file_name_length = struct.unpack("i", _recv_exact(conn, 4))[0]
+        file_name = _recv_exact(conn, file_name_length).decode("utf-8")
+        offset, length = struct.unpack("QQ", _recv_exact(conn, 16))
+        if file_name not in files:
+            logger.warning(f"Requested file {file_name} is not available.")
+            return
+        # send file content
+        with open(files[file_name], "rb") as f:
+            conn.sendfile(f, offset, length)
 
     def _download_handler(conn):
         """
@@ -123,14 +210,16 @@ def run_sync_server(host: str, port: int, model_path: str, split_path: str):
         Args:
             conn (socket.socket): The connection socket to the client.
         """
-        # receive the rank from the requesting node
-        rank_data = conn.recv(4)
-        rank = struct.unpack("i", rank_data)[0]
-        logger.info(f"Received file request from node {rank}.")
-        # get files to be sent
-        files_to_send = _get_files_to_send(rank)
-        # send files to the requesting node
-        _send_files(conn, files_to_send)
+        with conn:
+            # receive the request type and the rank from the requesting node
+            request_type, rank = struct.unpack("ii", _recv_exact(conn, 8))
+            # get files to be sent
+            files_to_send = _get_files_to_send(rank)
+            if request_type == REQUEST_MANIFEST:
+                logger.info(f"Received file request from node {rank}.")
+                _send_manifest(conn, files_to_send)
+            elif request_type == REQUEST_CHUNK:
+                _send_chunk(conn, files_to_send)
 
     def _download_listener():
         """
@@ -138,7 +227,7 @@ def run_sync_server(host: str, port: int, model_path: str, split_path: str):
         """
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.bind((host, port))
-            s.listen(20)  # Listen for up to 20 connections
+            s.listen(128)  # Each node downloads over multiple connections
             while True:
                 conn, addr = s.accept()
                 client_thread = threading.Thread(target=_download_handler, args=(conn,))
@@ -147,3 +236,87 @@ def run_sync_server(host: str, port: int, model_path: str, split_path: str):
     server_thread = threading.Thread(target=_download_listener)
     server_thread.daemon = True
     server_thread.start()
+
+
+def _read_file_to_tensor(file_path: str, size: int) -> torch.Tensor:
+    """
+    Read a file into a uint8 tensor of the given size, which may be larger than the file.
+    """
+    tensor = torch.zeros(size, dtype=torch.uint8)
+    with open(file_path, "rb") as f:
+        f.readinto(tensor.numpy())
+    return tensor
+
+
+def _write_tensor_to_file(tensor: torch.Tensor, file_path: str):
+    """
+    Write the bytes of a uint8 tensor to a file.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(tensor.numpy())
+
+
+def sync_model_files(rank: int, model_path: str, split_path: str, force: bool = False):
+    """
+    Distribute sliced model parameter files from the master node to all other nodes with collective
+    communication instead of the file server. Files shared by all nodes are broadcast, and the split
+    weight files of each node are scattered. This must be called on all nodes.
+
+    Args:
+        rank (int): The rank of the current node.
+        model_path (str): The directory containing the main model files.
+        split_path (str): The directory containing the split model files.
+        force (bool, optional): Whether to receive the files even if they exist. Defaults to False.
+    """
+    world_size = dist.get_world_size()
+
+    # check which nodes need the files
+    need_files = [None] * world_size
+    dist.all_gather_object(need_files, rank != 0 and (force or not os.path.exists(split_path)))
+    if not any(need_files):
+        return
+
+    # the master node sends the file lists, in paths relative to the model path and file sizes
+    manifest = [None, None]
+    if rank == 0:
+        shared_files = sorted(set(os.listdir(model_path)).intersection(FILES_TO_SYNC))
+        manifest[0] = [(fn, os.path.getsize(os.path.join(model_path, fn))) for fn in shared_files]
+        manifest[1] = [[] for _ in range(world_size)]
+        for node_rank in range(1, world_size):
+            node_file_path = os.path.join(split_path, f"node_{node_rank}")
+            for fn in sorted(os.listdir(node_file_path)):
+                file_path = os.path.join(node_file_path, fn)
+                manifest[1][node_rank].append((os.path.relpath(file_path, model_path), os.path.getsize(file_path)))
+    dist.broadcast_object_list(manifest, src=0)
+    shared_files, node_files = manifest
+    if need_files[rank]:
+        logger.info(f"Receiving {len(shared_files) + len(node_files[rank])} files from the master node.")
+
+    # broadcast the files shared by all nodes
+    for rel_path, file_size in shared_files:
+        if rank == 0:
+            tensor = _read_file_to_tensor(os.path.join(model_path, rel_path), file_size)
+        else:
+            tensor = torch.empty(file_size, dtype=torch.uint8)
+        dist.broadcast(tensor, src=0)
+        if need_files[rank]:
+            _write_tensor_to_file(tensor, os.path.join(model_path, rel_path))
+
+    # scatter the split weight files, the i-th file of all nodes are sent together and padded to the same size
+    num_slots = max(len(files) for files in node_files)
+    for i in tqdm(range(num_slots), leave=True, disable=not need_files[rank]):
+        slot_files = [files[i] if i < len(files) else None for files in node_files]
+        slot_size = max(f[1] for f in slot_files if f is not None)
+        scatter_list = None
+        if rank == 0:
+            scatter_list = [
+                _read_file_to_tensor(os.path.join(model_path, f[0]), slot_size) if f is not None
+                else torch.empty(slot_size, dtype=torch.uint8)
+                for f in slot_files
+            ]
+        tensor = torch.empty(slot_size, dtype=torch.uint8)
+        dist.scatter(tensor, scatter_list, src=0)
+        if need_files[rank] and slot_files[rank] is not None:
+            rel_path, file_size = slot_files[rank]
+            _write_tensor_to_file(tensor[:file_size], os.path.join(model_path, rel_path))
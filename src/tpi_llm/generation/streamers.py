@@ -0,0 +1,78 @@
+import torch
+from transformers import TextStreamer
+
+# pieces that start a new word in SentencePiece and byte-level BPE tokenizers
+WORD_START_PIECES = (" ", "<0x20>", "Ġ", "▁")
+# pieces that end a line
+NEWLINE_PIECES = ("\n", "<0x0A>", "Ċ")
+
+
+class BatchedTextStreamer(TextStreamer):
+    """
+    A `TextStreamer` that decodes generated tokens in batches instead of one by one. The pending tokens are
+    decoded once every `flush_interval` tokens, or earlier when a token starts a new word, ends a line or is
+    a special token, which keeps the streamed text responsive while moving the detokenization off most
+    decoding steps.
+
+    Parameters:
+        tokenizer (AutoTokenizer):
+            The tokenizer used to decode the tokens.
+        skip_prompt (bool, optional):
+            Whether to skip the prompt to `.generate()` or not. Defaults to False.
+        flush_interval (int, optional):
+            The maximum number of tokens to buffer before decoding. Defaults to 4.
+        decode_kwargs (dict, optional):
+            Additional keyword arguments to pass to the tokenizer's `decode` method.
+    """
+
+    def __init__(self, tokenizer, skip_prompt: bool = False, flush_interval: int = 4, **decode_kwargs):
+        super().__init__(tokenizer, skip_prompt, **decode_kwargs)
+        self.flush_interval = flush_interval
+        self.pending_tokens = []
+        self.special_ids = set(tokenizer.all_special_ids)
+
+    def _is_boundary(self, token_id: int) -> bool:
+        """
+        Returns whether the token is a special token, starts a new word or ends a line. When a token starts
+        a new word, the word before it is complete, and `TextStreamer` prints the text up to the new word.
+        """
+        if token_id in self.special_ids:
+            return True
+        piece = self.tokenizer.convert_ids_to_tokens(token_id)
+        return piece is not None and (piece.startswith(WORD_START_PIECES) or piece.endswith(NEWLINE_PIECES))
+
+    def put(self, value):
+        """
+        Receives tokens, and decodes and prints them once enough tokens are buffered or a boundary is met.
+        """
+        if len(value.shape) > 1 and value.shape[0] > 1:
+            raise ValueError("BatchedTextStreamer only supports batch size 1")
+        elif len(value.shape) > 1:
+            value = value[0]
+
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+
+        token_ids = value.tolist()
+        if not token_ids:
+            return
+        self.pending_tokens.extend(token_ids)
+        if len(self.pending_tokens) >= self.flush_interval or self._is_boundary(token_ids[-1]):
+            self._flush()
+
+    def _flush(self):
+        """
+        Passes the pending tokens to `TextStreamer.put`, which decodes the token cache and prints the text
+        that is ready.
+        """
+        if self.pending_tokens:
+            pending_tokens, self.pending_tokens = self.pending_tokens, []
+            super().put(torch.tensor(pending_tokens, dtype=torch.long))
+
+    def end(self):
+        """
+        Flushes any remaining cache and prints a newline to stdout.
+        """
+        self._flush()
+        super().end()
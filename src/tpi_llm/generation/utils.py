@@ -10,6 +10,7 @@ from transformers import (
     DynamicCache,
 )
 from ..distributed import DistributedCommPrimitive
+from ..cache_utils import TPIPagedCache, TPIStaticCache
 
 
 class TPIGenerationMixin(GenerationMixin):
@@ -73,6 +74,8 @@ class TPIGenerationMixin(GenerationMixin):
             while unfinished.item() == 1.:
                 # prepare model inputs
                 model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
+                # only the logits of the last token are needed to select the next token
+                model_inputs["num_logits_to_keep"] = 1
 
                 # forward pass to get next token
                 outputs = self(**model_inputs, return_dict=True)
@@ -110,7 +113,7 @@ class TPIGenerationMixin(GenerationMixin):
 
                 # update finish status and synchronize with other nodes
                 unfinished = unfinished & ~stopping_criteria(input_ids, scores)
-                DistributedCommPrimitive.broadcast([unfinished.cpu()], src=0)
+                DistributedCommPrimitive.broadcast_tensor(unfinished.cpu(), src=0)
 
                 # This is needed to properly delete outputs.logits which may be very large for first iteration
                 # Otherwise a reference to outputs is kept which keeps the logits alive in the next iteration
@@ -121,12 +124,25 @@ class TPIGenerationMixin(GenerationMixin):
             return input_ids
         else:
             # for non-master nodes
-            unfinished = [torch.ones(1, dtype=torch.long)]
-            while unfinished[0].item() == 1.:
-                # assist forward pass to get next token
-                self(**model_kwargs)
+            unfinished = torch.ones(1, dtype=torch.long)
+            while unfinished.item() == 1.:
+                # assist forward pass to get next token, keeping the same logits as the master node
+                self(**model_kwargs, num_logits_to_keep=1)
                 # retrieve finish status from the master node
-                DistributedCommPrimitive.broadcast(unfinished, src=0)
+                DistributedCommPrimitive.broadcast_tensor(unfinished, src=0)
+
+    def _prepare_static_cache(self, model_kwargs, max_length: Optional[int] = None):
+        """
+        Creates a key value cache preallocated for the whole generation. The master node sends the final
+        max_length, which includes the prompt, to other nodes, so that the caches of all nodes are sized alike.
+
+        Parameters:
+        - model_kwargs: The model keyword arguments, to which the cache is added as `past_key_values`.
+        - max_length: The maximum length of the generated sequence including the prompt, given on the master node.
+        """
+        max_cache_len = torch.tensor([max_length if self.rank == 0 else 0], dtype=torch.long)
+        DistributedCommPrimitive.broadcast_tensor(max_cache_len, src=0)
+        model_kwargs["past_key_values"] = TPIStaticCache(max_cache_len=max_cache_len.item())
 
     def _validate_input(self, input_tensor):
         """
@@ -200,12 +216,14 @@ class TPIGenerationMixin(GenerationMixin):
         )
         self._validate_input(inputs_tensor)
 
-        # kvcache
+        # kvcache, the static cache is opted in with `cache_implementation="static"`, and is created once
+        # the final max_length is known
         model_kwargs["use_cache"] = generation_config.use_cache
         cache_name = "past_key_values"
         past = model_kwargs.get(cache_name, None)
-        if past is None:
-            model_kwargs[cache_name] = (DynamicCache())
+        use_static_cache = past is None and generation_config.cache_implementation == "static"
+        if past is None and not use_static_cache:
+            model_kwargs[cache_name] = (TPIPagedCache())
         elif isinstance(past, tuple):
             model_kwargs[cache_name] = (DynamicCache.from_legacy_cache(past))
 
@@ -252,6 +270,9 @@ class TPIGenerationMixin(GenerationMixin):
             )
             self._validate_generated_length(generation_config, input_ids_length, has_default_max_length)
 
+            if use_static_cache:
+                self._prepare_static_cache(model_kwargs, generation_config.max_length)
+
             # prepare stopping criteria.
             prepared_stopping_criteria = self._get_stopping_criteria(
                 generation_config=generation_config, stopping_criteria=stopping_criteria, tokenizer=tokenizer, **kwargs
@@ -288,6 +309,8 @@ class TPIGenerationMixin(GenerationMixin):
             )
         else:
             # for non-master nodes, just run sampling without preprocessing.
+            if use_static_cache:
+                self._prepare_static_cache(model_kwargs)
             self._sample(
                 input_ids=None,
                 logits_processor=None,
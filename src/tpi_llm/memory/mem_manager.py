@@ -1,21 +1,135 @@
+import io
 import os
-import re
 import time
+import queue
 import torch
-import asyncio
+import psutil
+import threading
 import numpy as np
-from typing import Tuple, Deque
+import zstandard as zstd
+import safetensors.torch
+from typing import Tuple, Deque, Dict, List, FrozenSet, Optional
 from collections import deque
-from memory_profiler import memory_usage
+from contextlib import contextmanager
+from safetensors import safe_open
 from concurrent.futures import ThreadPoolExecutor, Future
+from ..split import convert_split_to_safetensors, fuse_gate_up_projections, validate_output_split
+from ..quantization import dequantize_int8
 from ..utils import (
     BLOCK_TEMPLATE,
     ATTN_SAVE_PATH,
     MLP_SAVE_PATH,
     INPUT_SAVE_PATH,
     OUTPUT_SAVE_PATH,
+    COMPRESSED_SUFFIX,
+    QUANT_SCALE_SUFFIX,
 )
 
+PREFETCH_CHUNK_SIZE = 16 * 1024 * 1024
+BUFFER_ALIGNMENT = 64
+
+
+def _prefetch_file(file_path: str):
+    """
+    Reads a weight file ahead of time so that its pages are in the page cache when the file
+    is memory-mapped later.
+
+    Args:
+        file_path (str): The path of the weight file to prefetch.
+    """
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+
+    try:
+        if hasattr(os, "posix_fadvise"):
+            # let the kernel issue asynchronous readahead for the whole file
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            # posix_fadvise is not available on macOS, read the file through instead
+            offset = 0
+            while True:
+                data = os.pread(fd, PREFETCH_CHUNK_SIZE, offset)
+                if not data:
+                    break
+                offset += len(data)
+    finally:
+        os.close(fd)
+
+
+def _format_array(values: np.ndarray) -> str:
+    """
+    Formats a 1-d array as a comma-separated string, without converting its values to Python floats.
+    """
+    buffer = io.StringIO()
+    np.savetxt(buffer, values, fmt="%.6f", newline=", ")
+    return buffer.getvalue()[:-len(", ")]
+
+
+class _DecompressedFile(dict):
+    """
+    The weights of a decompressed file, exposing the same `keys()` and `get_tensor()` accessors
+    as a file opened by safetensors.safe_open.
+    """
+
+    def get_tensor(self, key: str) -> torch.Tensor:
+        return self[key]
+
+
+@contextmanager
+def _open_weight_file(file_path: str):
+    """
+    Opens a weight file for reading. Plain SafeTensors files are memory-mapped, while Zstd
+    compressed files are decompressed into memory as a whole.
+
+    Args:
+        file_path (str): The path of the weight file to open.
+    """
+    if file_path.endswith(COMPRESSED_SUFFIX):
+        with open(file_path, "rb") as f:
+            data = zstd.ZstdDecompressor().stream_reader(f).read()
+        yield _DecompressedFile(safetensors.torch.load(data))
+    else:
+        with safe_open(file_path, framework="pt", device="cpu") as f:
+            yield f
+
+
+def _resolve_weight_file(file_path: str) -> str:
+    """
+    Returns the path of the Zstd compressed variant of a weight file if it exists,
+    otherwise the path itself.
+    """
+    compressed_path = file_path + COMPRESSED_SUFFIX
+    return compressed_path if os.path.exists(compressed_path) else file_path
+
+
+class TrackEvent(threading.Event):
+    """
+    An event signalling the completion of a track job, which is set once all stages of the job are
+    finished. If any stage fails, its exception is kept and re-raised by MemoryManager.wait().
+    """
+
+    def __init__(self, num_stages: int = 1):
+        super().__init__()
+        self.exception: Optional[Exception] = None
+        self._num_pending_stages = num_stages
+        self._lock = threading.Lock()
+
+    def finish_stage(self, exception: Optional[Exception] = None):
+        """
+        Marks a stage of the job as finished, and sets the event if it is the last one.
+
+        Args:
+            exception (Exception, optional): The exception raised by the stage, if any.
+        """
+        with self._lock:
+            if exception is not None and self.exception is None:
+                self.exception = exception
+            self._num_pending_stages -= 1
+            if self._num_pending_stages == 0:
+                self.set()
+
 
 class MemoryManager:
     def __init__(self, model, rank, args):
@@ -23,171 +137,426 @@ class MemoryManager:
         self._device = model.device
         self._rank = rank
         self._split_dir = os.path.join(args.model_path, args.save_dir, f"node_{rank}")
-        self._all_layers = set(model.state_dict().keys())
+        convert_split_to_safetensors(self._split_dir)
+        fuse_gate_up_projections(self._split_dir)
         self._all_blocks = ["input"] + [
             BLOCK_TEMPLATE.format(l=block_idx, type=block_type)
             for block_idx in range(model.config.num_hidden_layers)
             for block_type in ["self_attn", "mlp"]
         ] + ["output"]
-        self._loaded_blocks: Deque[str] = deque(maxlen=args.memory_window)
-        self._layers_in_block = {block_key: [] for block_key in self._all_blocks}
-        self._memory_usage_history = np.array([[time.time(), memory_usage()[0]]])
-
-    def _get_bid_and_btype(self, block_name: str) -> Tuple[int, str]:
+        self._block_idx: Dict[str, int] = {block_name: idx for idx, block_name in enumerate(self._all_blocks)}
+        self._block_paths: Dict[str, str] = {
+            "input": _resolve_weight_file(os.path.join(self._split_dir, INPUT_SAVE_PATH)),
+            "output": _resolve_weight_file(os.path.join(self._split_dir, OUTPUT_SAVE_PATH)),
+        }
+        # fail early on splits made before the output head was split across nodes
+        validate_output_split(self._block_paths["output"], model.config.vocab_size, args.world_size, rank)
+        for block_idx in range(model.config.num_hidden_layers):
+            for block_type, save_path in [("self_attn", ATTN_SAVE_PATH), ("mlp", MLP_SAVE_PATH)]:
+                block_name = BLOCK_TEMPLATE.format(l=block_idx, type=block_type)
+                self._block_paths[block_name] = _resolve_weight_file(
+                    os.path.join(self._split_dir, save_path.format(l=block_idx)))
+        # loaded blocks are kept as (block name, index in self._all_blocks) to avoid lookups
+        self._loaded_blocks: Deque[Tuple[str, int]] = deque(maxlen=args.memory_window)
+        # whether each block in self._all_blocks is in self._loaded_blocks, for constant time lookups
+        self._loaded_mask = bytearray(len(self._all_blocks))
+        # on cuda devices, each loaded block lives in one of memory_window device buffers (slots), which are
+        # grown to the largest block size and reused instead of being freed on release
+        self._slot_buffers: List[Optional[torch.Tensor]] = [None] * args.memory_window
+        self._slot_events: List[Optional[torch.cuda.Event]] = [None] * args.memory_window
+        self._free_slots: Deque[int] = deque(range(args.memory_window))
+        self._block_slot: Dict[str, int] = {}
+        # blocks scheduled for release but not yet released, a block is not reloaded until its release is done
+        self._pending_releases: Dict[str, int] = {}
+        self._release_cond = threading.Condition()
+        # model tensor keys in each block, recorded when the block is loaded for the first time
+        self._block_keys: Dict[str, FrozenSet[str]] = {}
+        # keys of the int8 quantized tensors in each block, whose scales are stored in <key>_scale
+        self._block_quant_keys: Dict[str, FrozenSet[str]] = {}
+        # the model is not fully constructed yet, so its state_dict and keys are cached on first use
+        self._sd: Optional[Dict[str, torch.Tensor]] = None
+        self._all_layers: FrozenSet[str] = frozenset()
+        # shapes of the model tensors, which are emptied on release on cuda devices
+        self._tensor_shapes: Dict[str, torch.Size] = {}
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=args.memory_window)
+        self._prefetch_queue: Dict[str, Future] = {}
+        self._proc = psutil.Process()
+        self._mem_log: List[Tuple[float, float]] = [(time.time(), self._get_memory_usage())]
+        # two persistent worker threads run the release and load stages of track jobs in a pipeline, the
+        # load worker has its own stream for host-to-device copies
+        self._copy_stream = torch.cuda.Stream(self._device) if self._device.type == "cuda" else None
+        self._compute_stream = torch.cuda.current_stream(self._device) if self._device.type == "cuda" else None
+        self._release_queue: queue.Queue = queue.Queue()
+        self._load_queue: queue.Queue = queue.Queue()
+        self._release_worker = threading.Thread(target=self._release_loop, daemon=True)
+        self._load_worker = threading.Thread(target=self._load_loop, daemon=True)
+        self._release_worker.start()
+        self._load_worker.start()
+
+    def _get_memory_usage(self) -> float:
         """
-        Extracts the block id and block type from the given block name.
-
-        Args:
-            block_name (str): The name of the block, following the BLOCK_TEMPLATE pattern.
+        Returns the resident memory of the current process in MiB.
+        """
+        return self._proc.memory_info().rss / 1024 ** 2
 
-        Returns:
-            Tuple[int, str]: A tuple containing the block id (int) and block type (str).
+    def _get_state_dict(self) -> Dict[str, torch.Tensor]:
+        """
+        Returns the cached state_dict of the model. The parameters are kept as they are (`keep_vars=True`),
+        so that their data can be rebound to device buffers.
+        """
+        if self._sd is None:
+            self._sd = dict(self._model.state_dict(keep_vars=True))
+            self._all_layers = frozenset(self._sd.keys())
+            self._tensor_shapes = {key: tensor_.shape for key, tensor_ in self._sd.items()}
+        return self._sd
 
+    def _check_shape(self, file_path: str, key: str, weight: torch.Tensor):
         """
-        pattern = BLOCK_TEMPLATE.format(type=r'(\w+)', l=r'(\d+)')
-        match = re.match(pattern, block_name)
-        if match:
-            return int(match.group(2)), match.group(1)
-        else:
-            raise ValueError(f"Key '{block_name}' does not match pattern '{pattern}'")
+        Raises an error if a weight read from a file does not match the shape of its model tensor, which
+        happens when the split files were made by another version or for another number of nodes.
+        """
+        if weight.shape != self._tensor_shapes[key]:
+            raise ValueError(f"Weight {key} in {file_path} has shape {tuple(weight.shape)}, but the model expects "
+                             f"{tuple(self._tensor_shapes[key])}. Split the model again.")
 
-    def _load_block_until_filled(self, block_name: str):
+    def _get_slot_buffer(self, slot: int, nbytes: int) -> torch.Tensor:
         """
-        Loads multiple blocks starting from the given block until self._loaded_blocks is full.
+        Returns the device buffer of the given slot, growing it if it is smaller than nbytes.
 
         Args:
-            block_name (str): The starting block name to load.
+            slot (int): The index of the slot.
+            nbytes (int): The number of bytes required.
         """
-        # ensure the block_name exists
-        if block_name not in self._all_blocks:
-            raise ValueError("Block name {} is not valid.".format(block_name))
-
-        # get the starting index of block_name
-        start_idx = self._all_blocks.index(block_name)
-
-        # load blocks sequentially until the deque is full
-        for idx in range(start_idx, len(self._all_blocks)):
-            block_name_ = self._all_blocks[idx]
+        buffer = self._slot_buffers[slot]
+        if buffer is None or buffer.numel() < nbytes:
+            self._slot_buffers[slot] = None
+            del buffer
+            try:
+                buffer = torch.empty(nbytes, dtype=torch.uint8, device=self._device)
+            except torch.cuda.OutOfMemoryError:
+                # return the cached memory to the device and retry once
+                torch.cuda.empty_cache()
+                buffer = torch.empty(nbytes, dtype=torch.uint8, device=self._device)
+            # the buffer is allocated on the copy stream but read by the compute stream
+            buffer.record_stream(self._compute_stream)
+            self._slot_buffers[slot] = buffer
+        return buffer
+
+    def _copy_block_to_device(
+        self, block_name: str, weights: Dict[str, torch.Tensor], quant_keys: FrozenSet[str],
+        state_dict: Dict[str, torch.Tensor]
+    ):
+        """
+        Copies the weights of a block to the device with a single host-to-device transfer. The weights are
+        packed into one pinned host buffer, which is copied at once to the device buffer of a free slot, and
+        the model tensors are then rebound to views of the device buffer. Int8 quantized weights are copied
+        along with their scales and dequantized on the device.
 
-            # skip if the block is already loaded
-            if block_name_ in self._loaded_blocks:
+        Args:
+            block_name (str): The name of the block to copy.
+            weights (Dict[str, torch.Tensor]): The weights of the block on cpu.
+            quant_keys (FrozenSet[str]): The keys of the int8 quantized weights.
+            state_dict (Dict[str, torch.Tensor]): The model tensors to be rebound.
+        """
+        offsets, total_bytes = {}, 0
+        for key, weight in weights.items():
+            offsets[key] = total_bytes
+            nbytes = weight.numel() * weight.element_size()
+            total_bytes += (nbytes + BUFFER_ALIGNMENT - 1) // BUFFER_ALIGNMENT * BUFFER_ALIGNMENT
+
+        # pack the weights into a pinned host buffer and copy it to the device in one go
+        host_buffer = torch.empty(total_bytes, dtype=torch.uint8, pin_memory=True)
+        for key, weight in weights.items():
+            nbytes = weight.numel() * weight.element_size()
+            host_buffer[offsets[key]:offsets[key] + nbytes].copy_(weight.reshape(-1).view(torch.uint8))
+        with self._release_cond:
+            # wait for the release worker to return a slot
+            while not self._free_slots:
+                self._release_cond.wait()
+            slot = self._free_slots.popleft()
+        if self._slot_events[slot] is not None:
+            # wait for the computation on the previous block in this slot to finish
+            self._copy_stream.wait_event(self._slot_events[slot])
+        self._block_slot[block_name] = slot
+        device_buffer = self._get_slot_buffer(slot, total_bytes)
+        device_buffer[:total_bytes].copy_(host_buffer, non_blocking=True)
+
+        # rebind model tensors to views of the device buffer
+        device_weights = {}
+        for key, weight in weights.items():
+            nbytes = weight.numel() * weight.element_size()
+            tensor_ = device_buffer[offsets[key]:offsets[key] + nbytes]
+            device_weights[key] = tensor_.view(weight.dtype).view(weight.shape)
+        for key, tensor_ in device_weights.items():
+            if key not in state_dict:
                 continue
+            if key in quant_keys:
+                tensor_ = dequantize_int8(tensor_, device_weights[key + QUANT_SCALE_SUFFIX], state_dict[key].dtype)
+                tensor_.record_stream(self._compute_stream)
+            elif tensor_.dtype != state_dict[key].dtype:
+                tensor_ = tensor_.to(state_dict[key].dtype)
+                tensor_.record_stream(self._compute_stream)
+            state_dict[key].data = tensor_
+
+    def _prefetch_next_blocks(self):
+        """
+        Submits read requests for the blocks following the memory window, so that the disk reads
+        overlap with the computation of the blocks currently loaded.
+        """
+        if not self._loaded_blocks:
+            return
 
-            # append the loaded block name to the deque
-            self._loaded_blocks.append(block_name_)
-
-            # determine the path to the binary file
-            if block_name_ == "input":
-                bin_path = os.path.join(self._split_dir, INPUT_SAVE_PATH)
-            elif block_name_ == "output":
-                bin_path = os.path.join(self._split_dir, OUTPUT_SAVE_PATH)
-            elif "self_attn" in block_name_:
-                block_id, _ = self._get_bid_and_btype(block_name_)
-                bin_path = os.path.join(self._split_dir, ATTN_SAVE_PATH.format(l=block_id))
-            elif "mlp" in block_name_:
-                block_id, _ = self._get_bid_and_btype(block_name_)
-                bin_path = os.path.join(self._split_dir, MLP_SAVE_PATH.format(l=block_id))
-            else:
-                raise NotImplementedError(f"Block name {block_name} is not supported.")
+        start_idx = self._loaded_blocks[-1][1] + 1
+        for block_name in self._all_blocks[start_idx:start_idx + self._loaded_blocks.maxlen]:
+            if block_name not in self._prefetch_queue:
+                self._prefetch_queue[block_name] = self._prefetch_executor.submit(
+                    _prefetch_file, self._block_paths[block_name])
 
-            # load pretrained weights into model tensors
-            try:
-                with open(bin_path, 'rb') as f:
-                    pretrained_weights = torch.load(f, map_location=self._device)
+    def _schedule_blocks(self, block_name: str) -> Tuple[List[str], List[str]]:
+        """
+        Updates self._loaded_blocks for processing the given block: the blocks before the given block
+        are to be released, and the given block and its subsequent blocks are to be loaded until the
+        memory window is full.
 
-                for key, weight in pretrained_weights.items():
-                    if key in self._all_layers:
-                        self._model.state_dict()[key].copy_(weight)
-                        self._layers_in_block[block_name_].append(key)
+        Args:
+            block_name (str): The name of the block currently processing.
 
-                del pretrained_weights
-            except FileNotFoundError:
-                if block_name_ != "output":
-                    raise FileNotFoundError(f"Binary file {bin_path} not found.")
+        Returns:
+            Tuple[List[str], List[str]]: The names of the blocks to release, and of the blocks to load.
+        """
+        block_idx = self._block_idx[block_name]
+        loaded_blocks, loaded_mask = self._loaded_blocks, self._loaded_mask
+        window_size = loaded_blocks.maxlen
+        blocks_to_release, blocks_to_load = [], []
+
+        # release all blocks before this block, which are at the head of the deque
+        num_stale = 0
+        if block_idx == 0:
+            num_stale = len(loaded_blocks)
+        else:
+            for _, loaded_idx in loaded_blocks:
+                if loaded_idx >= block_idx:
+                    break
+                num_stale += 1
+        for _ in range(num_stale):
+            name, idx = loaded_blocks.popleft()
+            loaded_mask[idx] = 0
+            blocks_to_release.append(name)
 
-            # stop if the deque is full
-            if len(self._loaded_blocks) == self._loaded_blocks.maxlen:
+        # load blocks sequentially until the deque is full
+        all_blocks = self._all_blocks
+        idx = block_idx
+        while len(loaded_blocks) < window_size or not loaded_mask[block_idx]:
+            if idx == len(all_blocks):
                 break
 
-    def _release_block(self, block_name: str):
+            # skip if the block is already loaded
+            if not loaded_mask[idx]:
+                # release the oldest block if it would be evicted from the deque
+                if len(loaded_blocks) == window_size:
+                    name, evicted_idx = loaded_blocks.popleft()
+                    loaded_mask[evicted_idx] = 0
+                    blocks_to_release.append(name)
+                loaded_blocks.append((all_blocks[idx], idx))
+                loaded_mask[idx] = 1
+                blocks_to_load.append(all_blocks[idx])
+            idx += 1
+        return blocks_to_release, blocks_to_load
+
+    @torch.no_grad()
+    def _load_block(self, block_name: str):
         """
-        Releases the memory of the tensors associated with the specified block.
+        Loads the pretrained weights of a block into model tensors.
 
         Args:
-            block_name (str): The name of the block to release.
+            block_name (str): The name of the block to load.
         """
-        if block_name not in self._layers_in_block:
-            raise KeyError(f"Block name '{block_name}' not found in _layers_in_block.")
-
-        for layer_key in self._layers_in_block[block_name]:
-            tensor_ = self._model.state_dict()[layer_key]
+        state_dict = self._get_state_dict()
+
+        # determine the path to the weight file
+        file_path = self._block_paths[block_name]
+
+        # wait for the prefetch of this block to finish, if any
+        prefetch_task = self._prefetch_queue.pop(block_name, None)
+        if prefetch_task is not None:
+            prefetch_task.result()
+
+        # wait for the release of this block to finish, if it is being reloaded
+        with self._release_cond:
+            while block_name in self._pending_releases:
+                self._release_cond.wait()
+
+        # load pretrained weights into model tensors. uncompressed files are memory-mapped, so only
+        # the pages of the requested tensors are read instead of deserializing the whole file.
+        try:
+            with _open_weight_file(file_path) as f:
+                block_keys = self._block_keys.get(block_name)
+                if block_keys is None:
+                    file_keys = set(f.keys())
+                    block_keys = frozenset(key for key in file_keys if key in self._all_layers)
+                    self._block_keys[block_name] = block_keys
+                    # quantized weights are dequantized on load, unless the model keeps them in int8
+                    self._block_quant_keys[block_name] = frozenset(
+                        key for key in block_keys if key + QUANT_SCALE_SUFFIX in file_keys
+                        and key + QUANT_SCALE_SUFFIX not in self._all_layers)
+                    missing_keys = [key for key in self._all_layers if key.endswith(QUANT_SCALE_SUFFIX)
+                                    and key[:-len(QUANT_SCALE_SUFFIX)] in block_keys and key not in file_keys]
+                    if missing_keys:
+                        raise ValueError(f"Weight file {file_path} is not quantized, but the model expects "
+                                         "int8 weights. Split the model again with int8 quantization.")
+                quant_keys = self._block_quant_keys[block_name]
+                if self._device.type == "cuda":
+                    weights = {key: f.get_tensor(key) for key in block_keys}
+                    for key, weight in weights.items():
+                        self._check_shape(file_path, key, weight)
+                    weights.update({key + QUANT_SCALE_SUFFIX: f.get_tensor(key + QUANT_SCALE_SUFFIX)
+                                    for key in quant_keys})
+                    self._copy_block_to_device(block_name, weights, quant_keys, state_dict)
+                else:
+                    for key in block_keys:
+                        weight = f.get_tensor(key)
+                        self._check_shape(file_path, key, weight)
+                        if key in quant_keys:
+                            dequantize_int8(weight, f.get_tensor(key + QUANT_SCALE_SUFFIX),
+                                            state_dict[key].dtype, out=state_dict[key])
+                        else:
+                            state_dict[key].copy_(weight)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Weight file {file_path} not found.")
+
+    def _release_blocks(self, block_names: List[str]):
+        """
+        Releases the memory of the tensors associated with the specified blocks.
 
-            # release the tensor memory depending on its device type
-            if tensor_.device.type == 'cuda':
-                with torch.no_grad():
-                    tensor_.data = None  # de-referencing gpu memory
+        Args:
+            block_names (List[str]): The names of the blocks to release.
+        """
+        state_dict = self._get_state_dict()
+        slots = []
+        for block_name in block_names:
+            if block_name not in self._block_paths:
+                raise KeyError(f"Block name '{block_name}' not found in _block_paths.")
+
+            for layer_key in self._block_keys.get(block_name, ()):
+                tensor_ = state_dict[layer_key]
+
+                # release the tensor memory depending on its device type
+                if tensor_.device.type == 'cuda':
+                    with torch.no_grad():
+                        # drop the views of the slot buffer
+                        tensor_.data = torch.empty(0, dtype=tensor_.dtype, device=tensor_.device)
+                else:
+                    del tensor_  # deleting cpu tensor
+
+            slot = self._block_slot.pop(block_name, None)
+            if slot is not None:
+                slots.append(slot)
+
+        # return the slots to the pool. they are reused once the computation queued on them so far has
+        # finished, which is tracked by a single event for the batch, so there is no need to synchronize here.
+        if slots:
+            event = torch.cuda.Event()
+            event.record(self._compute_stream)
+            with self._release_cond:
+                for slot in slots:
+                    self._slot_events[slot] = event
+                    self._free_slots.append(slot)
+                self._release_cond.notify_all()
+
+    def _release_loop(self):
+        """
+        Runs the release stage of track jobs in submission order on the release worker thread.
+        """
+        while True:
+            block_names, event = self._release_queue.get()
+            exception = None
+            try:
+                self._release_blocks(block_names)
+            except Exception as e:
+                exception = e
+            finally:
+                with self._release_cond:
+                    for block_name in block_names:
+                        self._pending_releases[block_name] -= 1
+                        if self._pending_releases[block_name] == 0:
+                            del self._pending_releases[block_name]
+                    self._release_cond.notify_all()
+            event.finish_stage(exception)
+
+    def _load_loop(self):
+        """
+        Runs the load stage of track jobs in submission order on the load worker thread. On cuda devices,
+        the loads run on a dedicated copy stream so that host-to-device copies overlap with computation.
+        """
+        while True:
+            block_names, event = self._load_queue.get()
+            try:
+                if self._copy_stream is None:
+                    for block_name in block_names:
+                        self._load_block(block_name)
+                else:
+                    with torch.cuda.stream(self._copy_stream):
+                        for block_name in block_names:
+                            self._load_block(block_name)
+                    self._copy_stream.synchronize()
+                # record memory usage
+                self._mem_log.append((time.time(), self._get_memory_usage()))
+            except Exception as e:
+                event.finish_stage(e)
             else:
-                del tensor_  # deleting cpu tensor
+                event.finish_stage()
 
-        # force to clear gpu cache
-        torch.cuda.empty_cache()
-
-    def track(self, block_name: str, async_op: bool = False) -> Future:
+    def track(self, block_name: str, async_op: bool = False) -> TrackEvent:
         """
-        Starts a background task to schedule the loading and releasing of blocks.
+        Schedules the releasing of the blocks before the given block, and the loading of the given block and
+        its subsequent blocks until the memory window is full. The releases and loads are submitted to two
+        background workers, so that the disk reads of new blocks overlap with the release of old blocks.
 
         Args:
             block_name (str): The name of the block currently processing.
             async_op (bool, optional): Whether the task is asynchronous or not. Defaults to False.
 
         Returns:
-            Future: A concurrent.futures.Future object representing the asynchronous task.
-                Use self.wait() to wait for the background task to complete.
+            TrackEvent: An event which is set when both the releases and loads complete.
+                Use self.wait() to wait for the background job to complete.
         """
+        if block_name not in self._block_idx:
+            event = TrackEvent(num_stages=0)
+            event.set()
+            return event
 
-        def _track_func(block_name_: str):
-            if block_name_ not in self._all_blocks:
-                return
+        blocks_to_release, blocks_to_load = self._schedule_blocks(block_name)
+        with self._release_cond:
+            for block_name_ in blocks_to_release:
+                self._pending_releases[block_name_] = self._pending_releases.get(block_name_, 0) + 1
 
-            # release all blocks before this block
-            while self._loaded_blocks:
-                current_block = self._loaded_blocks[0]
-                if (block_name_ == "input" or
-                        self._all_blocks.index(current_block) < self._all_blocks.index(block_name_)):
-                    self._release_block(self._loaded_blocks.popleft())
-                else:
-                    break
-
-            # load the block and subsequent blocks until the deque is full
-            self._load_block_until_filled(block_name)
+        event = TrackEvent(num_stages=2)
+        self._release_queue.put((blocks_to_release, event))
+        self._load_queue.put((blocks_to_load, event))
 
-            # record memory usage
-            current_memory_usage = np.array([[time.time(), memory_usage()[0]]])
-            self._memory_usage_history = np.vstack((self._memory_usage_history, current_memory_usage))
+        # read the blocks after the memory window ahead of time
+        self._prefetch_next_blocks()
 
-        # Create a thread pool executor and run track function in the background using a thread pool
-        executor = ThreadPoolExecutor(max_workers=1)
-        loop = asyncio.get_event_loop()
-        track_thread = loop.run_in_executor(executor, _track_func, block_name)
-        if not async_op: self.wait(track_thread)
-        return track_thread
+        if not async_op: self.wait(event)
+        return event
 
-    def wait(self, thread: Future) -> any:
+    def wait(self, event: TrackEvent):
         """
-        Waits for the result of the given background task.
+        Waits for the given background job to complete.
 
         Args:
-            thread (Future): A concurrent.futures.Future object representing the background task.
+            event (TrackEvent): The event returned by self.track().
 
-        Returns:
-            any: The result of the background task.
+        Raises:
+            Exception: The exception raised by the background job, if any.
         """
-        loop = asyncio.get_event_loop()
-        result = loop.run_until_complete(thread)
-        return result
+        event.wait()
+        if event.exception is not None:
+            raise event.exception
 
     @property
     def memory_history(self):
-        log_ts_str = ', '.join([str(t) for t in self._memory_usage_history[:, 0].tolist()])
-        log_mem_str = ', '.join([str(m) for m in self._memory_usage_history[:, 1].tolist()])
+        memory_usage_history = np.array(self._mem_log)
+        log_ts_str = _format_array(memory_usage_history[:, 0])
+        log_mem_str = _format_array(memory_usage_history[:, 1])
         return log_ts_str, log_mem_str
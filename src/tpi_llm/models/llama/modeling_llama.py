@@ -1,8 +1,10 @@
 import argparse
+import functools
 import torch
 import numpy as np
 from torch import nn
-from typing import Optional, Union, Tuple
+from packaging import version
+from typing import Optional, Union, Tuple, Type
 from transformers.models.llama import LlamaPreTrainedModel, LlamaForCausalLM, LlamaConfig
 from transformers.models.llama.modeling_llama import LlamaRMSNorm, LlamaRotaryEmbedding
 from transformers import Cache
@@ -10,9 +12,13 @@ from transformers.modeling_outputs import CausalLMOutputWithPast, BaseModelOutpu
 from transformers.activations import ACT2FN
 from ...modeling_utils import TPIPreTrainedModel
 from ...memory import MemoryManager
-from ...split import get_heads_per_node
+from ...split import get_heads_per_node, get_vocab_range
+from ...quantization import HAS_INT8PACK_MM, Int8WoQLinear
 from ...distributed import DistributedCommPrimitive
 
+# since torch 2.5, sdpa accepts key and value states with fewer heads than query states
+SDPA_SUPPORTS_GQA = version.parse(torch.__version__).release >= (2, 5)
+
 
 def _prepare_4d_causal_attention_mask_with_cache_position(
     attention_mask: torch.Tensor,
@@ -50,10 +56,9 @@ def _prepare_4d_causal_attention_mask_with_cache_position(
         # the mask comes already in inverted form
         causal_mask = attention_mask
     else:
-        causal_mask = torch.full((sequence_length, target_length), fill_value=min_dtype, dtype=dtype, device=device)
-        if sequence_length != 1:
-            causal_mask = torch.triu(causal_mask, diagonal=1)
-        causal_mask *= torch.arange(target_length, device=device) > cache_position.reshape(-1, 1)
+        # key j is masked for query i if j > cache_position[i], which also covers the upper triangle
+        causal_mask = torch.zeros((sequence_length, target_length), dtype=dtype, device=device).masked_fill_(
+            torch.arange(target_length, device=device) > cache_position.reshape(-1, 1), min_dtype)
         causal_mask = causal_mask[None, None, :, :].expand(batch_size, 1, -1, -1)
         if attention_mask is not None:
             causal_mask = causal_mask.clone()  # copy to contiguous memory for in-place edit
@@ -66,11 +71,21 @@ def _prepare_4d_causal_attention_mask_with_cache_position(
     return causal_mask
 
 
-def rotate_half(x):
-    """Rotates half the hidden dims of the input."""
-    x1 = x[..., : x.shape[-1] // 2]
-    x2 = x[..., x.shape[-1] // 2 :]
-    return torch.cat((-x2, x1), dim=-1)
+def _rotate(x, cos, sin):
+    """
+    Computes `x * cos + rotate_half(x) * sin` on the two halves of x separately, writing into one output
+    tensor instead of materializing `rotate_half(x)` with a concatenation.
+    """
+    half = x.shape[-1] // 2
+    x1, x2 = x[..., :half], x[..., half:]
+    out = torch.empty_like(x)
+    out1, out2 = out[..., :half], out[..., half:]
+    # out1 = x1 * cos1 - x2 * sin1, out2 = x2 * cos2 + x1 * sin2
+    torch.mul(x1, cos[..., :half], out=out1)
+    out1.addcmul_(x2, sin[..., :half], value=-1)
+    torch.mul(x2, cos[..., half:], out=out2)
+    out2.addcmul_(x1, sin[..., half:])
+    return out
 
 
 def apply_rotary_pos_emb(q, k, cos, sin, unsqueeze_dim=1):
@@ -93,11 +108,53 @@ def apply_rotary_pos_emb(q, k, cos, sin, unsqueeze_dim=1):
     """
     cos = cos.unsqueeze(unsqueeze_dim)
     sin = sin.unsqueeze(unsqueeze_dim)
-    q_embed = (q * cos) + (rotate_half(q) * sin)
-    k_embed = (k * cos) + (rotate_half(k) * sin)
+    q_embed = _rotate(q, cos, sin)
+    k_embed = _rotate(k, cos, sin)
+    return q_embed, k_embed
+
+
+def _apply_rotary_pos_emb_elementwise(q, k, cos, sin, unsqueeze_dim=1):
+    """
+    Same as `apply_rotary_pos_emb`, written in plain elementwise ops for torch.compile, which fuses them into
+    one kernel for each of q and k without materializing `rotate_half`.
+    """
+    cos = cos.unsqueeze(unsqueeze_dim)
+    sin = sin.unsqueeze(unsqueeze_dim)
+    half = q.shape[-1] // 2
+    q_embed = q * cos + torch.cat((-q[..., half:], q[..., :half]), dim=-1) * sin
+    k_embed = k * cos + torch.cat((-k[..., half:], k[..., :half]), dim=-1) * sin
     return q_embed, k_embed
 
 
+def _silu_and_mul(gate_up: torch.Tensor) -> torch.Tensor:
+    """
+    Computes `silu(gate) * up` from the output of the fused gate_up_proj.
+    """
+    gate, up = gate_up.chunk(2, dim=-1)
+    return nn.functional.silu(gate) * up
+
+
+def _rms_norm(hidden_states: torch.Tensor, weight: torch.Tensor, eps: float) -> torch.Tensor:
+    """
+    Same as `LlamaRMSNorm.forward`, as a function of its weight for torch.compile.
+    """
+    input_dtype = hidden_states.dtype
+    hidden_states = hidden_states.to(torch.float32)
+    variance = hidden_states.pow(2).mean(-1, keepdim=True)
+    hidden_states = hidden_states * torch.rsqrt(variance + eps)
+    return weight * hidden_states.to(input_dtype)
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(fn):
+    """
+    Compiles a function with torch.compile once, and shares the compiled function among all layers.
+    Only pure functions of tensors are compiled, because compiled modules would be recompiled for each
+    layer instance. Shapes are dynamic, so that new sequence lengths do not trigger recompilations.
+    """
+    return torch.compile(fn, dynamic=True)
+
+
 def repeat_kv(hidden_states: torch.Tensor, n_rep: int) -> torch.Tensor:
     """
     This is the equivalent of torch.repeat_interleave(x, dim=1, repeats=n_rep). The hidden states go from (batch,
@@ -118,7 +175,9 @@ class TPILlamaAttention(nn.Module):
         layer_idx: int,
         num_heads: int,
         num_kv_heads: int,
-        head_dim: int
+        head_dim: int,
+        linear_cls: Type[nn.Module] = nn.Linear,
+        torch_compile: bool = False
     ):
         super().__init__()
         self.config = config
@@ -133,12 +192,14 @@ class TPILlamaAttention(nn.Module):
         self.rope_theta = config.rope_theta
         self.is_causal = True
 
-        self.q_proj = nn.Linear(self.hidden_size, self.num_heads * self.head_dim, bias=config.attention_bias)
-        self.k_proj = nn.Linear(self.hidden_size, self.num_key_value_heads * self.head_dim, bias=config.attention_bias)
-        self.v_proj = nn.Linear(self.hidden_size, self.num_key_value_heads * self.head_dim, bias=config.attention_bias)
-        self.o_proj = nn.Linear(self.num_heads * self.head_dim, self.hidden_size, bias=config.attention_bias)
+        self.q_proj = linear_cls(self.hidden_size, self.num_heads * self.head_dim, bias=config.attention_bias)
+        self.k_proj = linear_cls(self.hidden_size, self.num_key_value_heads * self.head_dim, bias=config.attention_bias)
+        self.v_proj = linear_cls(self.hidden_size, self.num_key_value_heads * self.head_dim, bias=config.attention_bias)
+        self.o_proj = linear_cls(self.num_heads * self.head_dim, self.hidden_size, bias=config.attention_bias)
 
         self.rotary_emb = LlamaRotaryEmbedding(config=self.config)
+        self._apply_rotary_pos_emb = (
+            _compile(_apply_rotary_pos_emb_elementwise) if torch_compile else apply_rotary_pos_emb)
 
 
 class TPILlamaSdpaAttention(TPILlamaAttention):
@@ -163,16 +224,29 @@ class TPILlamaSdpaAttention(TPILlamaAttention):
         value_states = value_states.view(bsz, q_len, self.num_key_value_heads, self.head_dim).transpose(1, 2)
 
         cos, sin = position_embeddings
-        query_states, key_states = apply_rotary_pos_emb(query_states, key_states, cos, sin)
+        query_states, key_states = self._apply_rotary_pos_emb(query_states, key_states, cos, sin)
 
         cache_kwargs = {"sin": sin, "cos": cos, "cache_position": cache_position}
         key_states, value_states = past_key_value.update(key_states, value_states, self.layer_idx, cache_kwargs)
 
-        key_states = repeat_kv(key_states, self.num_key_value_groups)
-        value_states = repeat_kv(value_states, self.num_key_value_groups)
+        sdpa_kwargs = {}
+        # with a single query token, the query heads sharing a key value head are folded into the sequence
+        # dimension, so that they attend to the key value states as they are instead of repeated copies
+        fold_heads = not SDPA_SUPPORTS_GQA and self.num_key_value_groups > 1 and q_len == 1
+        if SDPA_SUPPORTS_GQA and self.num_key_value_groups > 1:
+            # broadcast key value heads inside sdpa instead of copying them
+            sdpa_kwargs["enable_gqa"] = True
+        elif fold_heads:
+            # (bsz, num_heads, 1, head_dim) -> (bsz, num_key_value_heads, num_key_value_groups, head_dim)
+            query_states = query_states.reshape(
+                bsz, self.num_key_value_heads, self.num_key_value_groups, self.head_dim)
+        else:
+            key_states = repeat_kv(key_states, self.num_key_value_groups)
+            value_states = repeat_kv(value_states, self.num_key_value_groups)
 
         causal_mask = attention_mask
-        causal_mask = causal_mask[:, :, :, : key_states.shape[-2]]
+        if causal_mask is not None:
+            causal_mask = causal_mask[:, :, :, : key_states.shape[-2]]
 
         if query_states.device.type == "cuda" and causal_mask is not None:
             query_states = query_states.contiguous()
@@ -181,6 +255,8 @@ class TPILlamaSdpaAttention(TPILlamaAttention):
 
         is_causal = True if causal_mask is None and q_len > 1 else False
 
+        # sdpa picks the flash or memory-efficient kernel when they support the inputs, and falls back to the
+        # math kernel otherwise, e.g. for enable_gqa on the memory-efficient kernel or on gpus without flash.
         attn_output = torch.nn.functional.scaled_dot_product_attention(
             query_states,
             key_states,
@@ -188,10 +264,14 @@ class TPILlamaSdpaAttention(TPILlamaAttention):
             attn_mask=causal_mask,
             dropout_p=0.,
             is_causal=is_causal,
+            **sdpa_kwargs,
         )
+        if fold_heads:
+            attn_output = attn_output.reshape(bsz, self.num_heads, q_len, self.head_dim)
 
-        attn_output = attn_output.transpose(1, 2).contiguous()
-        attn_output = attn_output.view(bsz, q_len, -1)
+        # reshape only copies when needed, the flash kernel already returns the output in (bsz, q_len, heads, dim)
+        # memory layout, and a single query token needs no reordering of heads.
+        attn_output = attn_output.transpose(1, 2).reshape(bsz, q_len, -1)
 
         attn_output = self.o_proj(attn_output)
 
@@ -200,19 +280,31 @@ class TPILlamaSdpaAttention(TPILlamaAttention):
 
 class TPILlamaMLP(nn.Module):
 
-    def __init__(self, config: LlamaConfig, rank: int, split_dim: int):
+    def __init__(
+        self,
+        config: LlamaConfig,
+        rank: int,
+        split_dim: int,
+        linear_cls: Type[nn.Module] = nn.Linear,
+        torch_compile: bool = False
+    ):
         super().__init__()
         self.config = config
         self.rank = rank
         self.hidden_size = config.hidden_size
         self.intermediate_size = split_dim
-        self.gate_proj = nn.Linear(self.hidden_size, self.intermediate_size, bias=config.mlp_bias)
-        self.up_proj = nn.Linear(self.hidden_size, self.intermediate_size, bias=config.mlp_bias)
-        self.down_proj = nn.Linear(self.intermediate_size, self.hidden_size, bias=config.mlp_bias)
+        # gate_proj and up_proj are fused into one linear layer, whose output is [gate, up]
+        self.gate_up_proj = linear_cls(self.hidden_size, 2 * self.intermediate_size, bias=config.mlp_bias)
+        self.down_proj = linear_cls(self.intermediate_size, self.hidden_size, bias=config.mlp_bias)
         self.act_fn = ACT2FN[config.hidden_act]
+        # the activation and multiplication are fused into one kernel with torch.compile
+        self._silu_and_mul = _compile(_silu_and_mul) if torch_compile and config.hidden_act == "silu" else None
 
     def forward(self, x):
-        return self.down_proj(self.act_fn(self.gate_proj(x)) * self.up_proj(x))
+        if self._silu_and_mul is not None:
+            return self.down_proj(self._silu_and_mul(self.gate_up_proj(x)))
+        gate, up = self.gate_up_proj(x).chunk(2, dim=-1)
+        return self.down_proj(self.act_fn(gate) * up)
 
 
 class TPILlamaDecoderLayer(nn.Module):
@@ -245,12 +337,17 @@ class TPILlamaDecoderLayer(nn.Module):
             num_heads=config.num_attention_heads,
             num_kv_heads=config.num_key_value_heads
         )
+        # with int8 split files, the projections keep their weights in int8 if the fused int8 kernel is available,
+        # otherwise the weights are dequantized when they are loaded
+        linear_cls = Int8WoQLinear if args.load_int8 and HAS_INT8PACK_MM and args.device == "cpu" else nn.Linear
         self.self_attn = TPILlamaSdpaAttention(
             config=config,
             layer_idx=layer_idx,
             num_heads=heads_per_node[rank],
             num_kv_heads=kv_heads_per_node[rank],
             head_dim=head_dim,
+            linear_cls=linear_cls,
+            torch_compile=args.torch_compile,
         )
 
         split_dims = (np.array(heads_per_node) * config.intermediate_size // sum(heads_per_node)).tolist()
@@ -259,10 +356,19 @@ class TPILlamaDecoderLayer(nn.Module):
                 "The sum of `split_dims` must be equal to `intermediate_size` "
                 f"(got `split_dims`: {split_dims}) and `intermediate_size`: {config.intermediate_size}.)"
             )
-        self.mlp = TPILlamaMLP(config, rank, split_dims[rank])
+        self.mlp = TPILlamaMLP(config, rank, split_dims[rank], linear_cls, args.torch_compile)
 
         self.input_layernorm = LlamaRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
         self.post_attention_layernorm = LlamaRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
+        self._rms_norm = _compile(_rms_norm) if args.torch_compile else None
+
+    def _norm(self, norm: LlamaRMSNorm, hidden_states: torch.Tensor) -> torch.Tensor:
+        """
+        Applies the given RMSNorm layer, with the compiled function if torch.compile is enabled.
+        """
+        if self._rms_norm is None:
+            return norm(hidden_states)
+        return self._rms_norm(hidden_states, norm.weight, norm.variance_epsilon)
 
     def forward(
         self,
@@ -278,7 +384,7 @@ class TPILlamaDecoderLayer(nn.Module):
 
         residual = hidden_states
 
-        hidden_states = self.input_layernorm(hidden_states)
+        hidden_states = self._norm(self.input_layernorm, hidden_states)
 
         hidden_states, self_attn_weights, present_key_value = self.self_attn(
             hidden_states=hidden_states,
@@ -290,24 +396,28 @@ class TPILlamaDecoderLayer(nn.Module):
             **kwargs,
         )
 
-        # perform allreduce to sum up hidden_states, meanwhile load next blocks
+        # perform allreduce to sum up hidden_states, meanwhile load next blocks in the background.
+        # the mlp weights are only needed after the residual connection, so wait for them there.
         comm_handler = DistributedCommPrimitive.allreduce(hidden_states, async_op=True)
-        self.mem_manager.track(f"mlp.{self.layer_idx}")
+        track_event = self.mem_manager.track(f"mlp.{self.layer_idx}", async_op=True)
         comm_handler.wait()
 
-        hidden_states = residual + hidden_states
+        # hidden_states is the fresh output of o_proj, so the residual is added in place
+        hidden_states.add_(residual)
+        self.mem_manager.wait(track_event)
 
         # Fully Connected
         residual = hidden_states
-        hidden_states = self.post_attention_layernorm(hidden_states)
+        hidden_states = self._norm(self.post_attention_layernorm, hidden_states)
         hidden_states = self.mlp(hidden_states)
 
-        # perform allreduce to sum up hidden_states, meanwhile load next blocks
+        # perform allreduce to sum up hidden_states, meanwhile load next blocks in the background
         comm_handler = DistributedCommPrimitive.allreduce(hidden_states, async_op=True)
-        self.mem_manager.track(f"self_attn.{self.layer_idx + 1}")
+        track_event = self.mem_manager.track(f"self_attn.{self.layer_idx + 1}", async_op=True)
         comm_handler.wait()
 
-        hidden_states = residual + hidden_states
+        hidden_states.add_(residual)
+        self.mem_manager.wait(track_event)
 
         outputs = (hidden_states,)
 
@@ -343,6 +453,38 @@ class TPILlamaModel(TPILlamaPreTrainedModel):
         )
         self.norm = LlamaRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
         self.rotary_emb = LlamaRotaryEmbedding(config=config)
+        # cos and sin tables of the rotary embedding for positions [0, len), grown on demand
+        self._rope_cos: Optional[torch.Tensor] = None
+        self._rope_sin: Optional[torch.Tensor] = None
+
+    def _get_position_embeddings(
+        self,
+        input_tensor: torch.Tensor,
+        position_ids: torch.LongTensor,
+        cache_position: torch.LongTensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns the cos and sin of the rotary embedding for the given positions, gathered from cached tables
+        instead of being recomputed at each step. Once a position exceeds the tables, they are rebuilt with a
+        length of the next power of two. Dynamic rope scaling changes the frequencies with the sequence length,
+        so it is computed by `rotary_emb` as before.
+        """
+        if "dynamic" in self.rotary_emb.rope_type:
+            return self.rotary_emb(input_tensor, position_ids)
+
+        # positions never exceed the cache position of the last token, even with left padding
+        num_positions = int(cache_position[-1]) + 1
+        dtype, device = input_tensor.dtype, input_tensor.device
+        if (self._rope_cos is None or self._rope_cos.shape[0] < num_positions
+                or self._rope_cos.dtype != dtype or self._rope_cos.device != device):
+            table_length = 1 << (num_positions - 1).bit_length()
+            inv_freq = self.rotary_emb.inv_freq.to(device=device, dtype=torch.float32)
+            freqs = torch.outer(torch.arange(table_length, device=device, dtype=torch.float32), inv_freq)
+            emb = torch.cat((freqs, freqs), dim=-1)
+            attention_scaling = getattr(self.rotary_emb, "attention_scaling", 1.0)
+            self._rope_cos = (emb.cos() * attention_scaling).to(dtype)
+            self._rope_sin = (emb.sin() * attention_scaling).to(dtype)
+        return self._rope_cos[position_ids], self._rope_sin[position_ids]
 
     def _update_causal_mask(
         self,
@@ -355,11 +497,24 @@ class TPILlamaModel(TPILlamaPreTrainedModel):
         dtype, device = input_tensor.dtype, input_tensor.device
         min_dtype = torch.finfo(dtype).min
         sequence_length = input_tensor.shape[1]
+
+        # without padding, the mask is purely causal when there is no past (is_causal is used instead)
+        # or a single query token (which attends to all keys), so no mask is needed for sdpa.
+        is_padded = attention_mask is not None and (attention_mask.dim() != 2 or not bool(attention_mask.all()))
+        if not is_padded and (sequence_length == 1 or past_seen_tokens == 0):
+            return None
         target_length = (
             attention_mask.shape[-1]
             if isinstance(attention_mask, torch.Tensor)
             else past_seen_tokens + sequence_length + 1
         )
+
+        if not is_padded:
+            # a boolean mask (True = attend) is enough without padding, which takes 1 byte per element
+            # instead of 2 or 4 for an additive mask, and needs no addition inside sdpa.
+            causal_mask = torch.arange(target_length, device=device) <= cache_position.reshape(-1, 1)
+            return causal_mask[None, None, :, :].expand(input_tensor.shape[0], 1, -1, -1)
+
         # In case the provided `attention` mask is 2D, we generate a causal mask here (4D).
         causal_mask = _prepare_4d_causal_attention_mask_with_cache_position(
             attention_mask,
@@ -373,6 +528,56 @@ class TPILlamaModel(TPILlamaPreTrainedModel):
         )
         return causal_mask
 
+    def _broadcast_metadata(
+        self,
+        input_ids: Optional[torch.LongTensor],
+        position_ids: Optional[torch.LongTensor],
+        cache_position: Optional[torch.LongTensor],
+        attention_mask: Optional[torch.Tensor],
+    ) -> Tuple[int, int, torch.LongTensor, torch.LongTensor, Optional[torch.Tensor]]:
+        """
+        Broadcasts the input metadata from the master node to all other nodes with raw int64 tensors instead of
+        pickled objects. A fixed header [bsz, seq_len, cache_start, mask_len] is sent first, followed by a flat
+        payload of position_ids and the 2D attention_mask only if the inputs are padded. Without padding, which
+        is the case at every decoding step, the header is all that is sent, and attention_mask is None.
+
+        Returns:
+            Tuple: bsz, seq_len, position_ids of shape (bsz, seq_len), cache_position of shape (seq_len,),
+            and attention_mask of shape (bsz, mask_len), or None.
+        """
+        header = torch.zeros(4, dtype=torch.int64)
+        if self.rank == 0:
+            bsz, seq_len = input_ids.shape
+            if attention_mask is not None and attention_mask.dim() != 2:
+                raise ValueError(f"Only 2D attention masks are supported (got {attention_mask.dim()}D).")
+            # without padding, attention_mask is all ones and position_ids equal cache_position
+            is_padded = attention_mask is not None and not bool(attention_mask.all())
+            mask_len = attention_mask.shape[-1] if is_padded else 0
+            header = torch.tensor([bsz, seq_len, int(cache_position[0]), mask_len], dtype=torch.int64)
+        DistributedCommPrimitive.broadcast_tensor(header, src=0)
+        bsz, seq_len, cache_start, mask_len = header.tolist()
+
+        if mask_len > 0:
+            if self.rank == 0:
+                if position_ids is None:
+                    position_ids = cache_position.unsqueeze(0).expand(bsz, -1)
+                payload = torch.cat([position_ids.reshape(-1).cpu(), attention_mask.reshape(-1).long().cpu()])
+            else:
+                payload = torch.empty(bsz * (seq_len + mask_len), dtype=torch.int64)
+            DistributedCommPrimitive.broadcast_tensor(payload, src=0)
+            if self.rank != 0:
+                device = self.embed_tokens.weight.device
+                position_ids = payload[:bsz * seq_len].view(bsz, seq_len).to(device)
+                attention_mask = payload[bsz * seq_len:].view(bsz, mask_len).to(device)
+
+        if self.rank != 0:
+            device = self.embed_tokens.weight.device
+            cache_position = torch.arange(cache_start, cache_start + seq_len, device=device)
+            if mask_len == 0:
+                position_ids = cache_position.unsqueeze(0).expand(bsz, -1)
+                attention_mask = None
+        return bsz, seq_len, position_ids, cache_position, attention_mask
+
     def forward(
         self,
         input_ids: torch.LongTensor = None,
@@ -386,27 +591,27 @@ class TPILlamaModel(TPILlamaPreTrainedModel):
         use_cache = use_cache if use_cache is not None else self.config.use_cache
         return_dict = return_dict if return_dict is not None else self.config.use_return_dict
 
-        inputs_embeds = None
-        position_embeddings = None
-        causal_mask = None
+        # the master node first broadcasts the small metadata needed to rebuild position_embeddings and causal_mask
+        # to all other nodes, so the O(seq_len^2) causal_mask is never sent over the network.
+        bsz, seq_len, position_ids, cache_position, attention_mask = self._broadcast_metadata(
+            input_ids, position_ids, cache_position, attention_mask)
+
         if self.rank == 0:
             # notify the memory manager to load input embedding weights.
             self.mem_manager.track("input")
             inputs_embeds = self.embed_tokens(input_ids)
-            # tuple of 2 tensors with shape (bs, seq_len, head_dim)
-            position_embeddings = self.rotary_emb(inputs_embeds, position_ids)
-            causal_mask = self._update_causal_mask(
-                attention_mask, inputs_embeds, cache_position, past_key_values)
-
-        # the master node broadcasts inputs_embeds, position_embedding, cache_position,
-        # and causal_mask to all other nodes.
-        # shape of inputs_embeds: (bs, seq_len, hidden_size)
-        # shape of position_embeddings: 2 Tuples of shape (bs, seq_len, head_dim)
-        # shape of cache_position: (seq_len,)
-        # shape of causal_mask: (1, 1, seq_len, seq_len)
-        broadcast_data = [inputs_embeds, position_embeddings, cache_position, causal_mask]
-        DistributedCommPrimitive.broadcast(broadcast_data, src=0)
-        inputs_embeds, position_embeddings, cache_position, causal_mask = broadcast_data
+        else:
+            inputs_embeds = torch.empty((bsz, seq_len, self.config.hidden_size),
+                                        dtype=self.embed_tokens.weight.dtype, device=self.embed_tokens.weight.device)
+        # then broadcasts inputs_embeds, which is in flight while all nodes compute position_embeddings and
+        # causal_mask locally, as they only depend on the shape, dtype and device of inputs_embeds.
+        comm_handler = DistributedCommPrimitive.broadcast_tensor(inputs_embeds, src=0, async_op=True)
+
+        # tuple of 2 tensors with shape (bs, seq_len, head_dim)
+        position_embeddings = self._get_position_embeddings(inputs_embeds, position_ids, cache_position)
+        # shape of causal_mask: (bs, 1, seq_len, target_length), or None if the mask is purely causal
+        causal_mask = self._update_causal_mask(attention_mask, inputs_embeds, cache_position, past_key_values)
+        comm_handler.wait()
 
         # decoder layers
         next_decoder_cache = None
@@ -428,8 +633,8 @@ class TPILlamaModel(TPILlamaPreTrainedModel):
             if use_cache:
                 next_decoder_cache = layer_outputs[1]
 
-        if self.rank == 0:
-            hidden_states = self.norm(hidden_states)
+        # all nodes hold the same hidden_states after the last allreduce, and compute a slice of the logits
+        hidden_states = self.norm(hidden_states)
 
         next_cache = next_decoder_cache
 
@@ -442,8 +647,9 @@ class TPILlamaModel(TPILlamaPreTrainedModel):
 class TPILlamaForCausalLM(LlamaForCausalLM, TPILlamaPreTrainedModel):
     """
     TPILlamaForCausalLM is an implementation of a causal language model based on Llama architecture,
-    integrating TPI (Tensor Parallel Inference) capabilities. Only the master node (rank 0) returns
-    output logits.
+    integrating TPI (Tensor Parallel Inference) capabilities. The output head is split across nodes
+    along the vocabulary, each node computes the logits of its slice, and only the master node (rank 0)
+    gathers and returns the output logits.
     """
 
     def __init__(
@@ -454,9 +660,20 @@ class TPILlamaForCausalLM(LlamaForCausalLM, TPILlamaPreTrainedModel):
     ):
         super().__init__(config)
         self.rank = rank
+        self.world_size = args.world_size
+        # each node holds the rows of the output head for its vocabulary range
+        self.vocab_start, self.vocab_end = get_vocab_range(config.vocab_size, args.world_size, rank)
+        self.lm_head = nn.Linear(config.hidden_size, self.vocab_end - self.vocab_start, bias=False)
         self.mem_manager = MemoryManager(self, rank, args)
         self.model = TPILlamaModel(config, rank, self.mem_manager, args)
 
+    def tie_weights(self):
+        """
+        The output head holds a vocabulary slice of this node, so it is never tied to the input embedding.
+        Models with tied word embeddings have the slices of the input embedding saved as the output head.
+        """
+        pass
+
     def forward(
         self,
         input_ids: torch.LongTensor = None,
@@ -466,6 +683,7 @@ class TPILlamaForCausalLM(LlamaForCausalLM, TPILlamaPreTrainedModel):
         use_cache: Optional[bool] = None,
         return_dict: Optional[bool] = None,
         cache_position: Optional[torch.LongTensor] = None,
+        num_logits_to_keep: int = 0,
         **kwargs
     ) -> Union[Tuple, CausalLMOutputWithPast]:
         """
@@ -486,6 +704,9 @@ class TPILlamaForCausalLM(LlamaForCausalLM, TPILlamaPreTrainedModel):
                 If True, returns a `CausalLMOutputWithPast` object instead of a plain tuple.
             cache_position (torch.LongTensor, optional):
                 Position indices within the cache, used in distributed settings.
+            num_logits_to_keep (int, optional):
+                Compute logits only for the last `num_logits_to_keep` tokens, or for all tokens if 0.
+                Generation only needs the logits of the last token.
             kwargs (dict, optional): Additional keyword arguments.
 
         Returns:
@@ -509,12 +730,29 @@ class TPILlamaForCausalLM(LlamaForCausalLM, TPILlamaPreTrainedModel):
 
         my_rank = self.rank
 
+        # each node computes the logits of its vocabulary range. slice the hidden states before lm_head,
+        # so the logits and their float upcast only cover the kept tokens.
+        hidden_states = outputs[0]
+        if num_logits_to_keep > 0:
+            hidden_states = hidden_states[:, -num_logits_to_keep:, :]
+        logits = self.lm_head(hidden_states)
+
+        # gather the logits to the master node. the vocabulary ranges have the same length except the last
+        # one, so the logits are padded to the same length for gathering and trimmed after. gloo does not
+        # gather cuda tensors, so the logits are gathered on the cpu.
+        chunk_size = (self.config.vocab_size + self.world_size - 1) // self.world_size
+        if logits.shape[-1] < chunk_size:
+            logits = nn.functional.pad(logits, (0, chunk_size - logits.shape[-1]))
+        logits = logits.cpu()
+        gather_list = [torch.empty_like(logits) for _ in range(self.world_size)] if my_rank == 0 else None
+        DistributedCommPrimitive.gather(logits, gather_list, dst=0)
+
         # non-master nodes return nothing.
         if my_rank != 0:
             return None
 
         # master node returns output logits, past kv cache, and other info if needed.
-        logits = self.lm_head(outputs[0]).float()
+        logits = torch.cat(gather_list, dim=-1)[..., :self.config.vocab_size].to(hidden_states.device).float()
 
         if not return_dict:
             return (logits,) + outputs[1:]
@@ -0,0 +1,101 @@
+import torch
+from torch import nn
+from typing import Dict, Iterable, Optional, Tuple
+from .utils import QUANT_SCALE_SUFFIX
+
+# fused int8 weight-only matmul, available on cpu since torch 2.3
+HAS_INT8PACK_MM = hasattr(torch, "_weight_int8pack_mm")
+
+
+def quantize_int8(weight: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Quantizes a weight matrix to int8 with per-output-channel absmax scales.
+
+    Args:
+        weight (torch.Tensor): The weight matrix of shape (out_features, in_features).
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: The int8 weight, and the float16 scales of shape (out_features, 1).
+    """
+    weight = weight.float()
+    scale = (weight.abs().amax(dim=-1, keepdim=True) / 127).clamp(min=1e-8).half()
+    q = (weight / scale.float()).round().clamp(-127, 127).to(torch.int8)
+    return q, scale
+
+
+def dequantize_int8(
+    q: torch.Tensor, scale: torch.Tensor, dtype: torch.dtype, out: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    """
+    Dequantizes an int8 weight matrix with its per-output-channel scales.
+
+    Args:
+        q (torch.Tensor): The int8 weight matrix.
+        scale (torch.Tensor): The scales of shape (out_features, 1).
+        dtype (torch.dtype): The dtype of the dequantized weight.
+        out (torch.Tensor, optional): The tensor to write the dequantized weight into.
+
+    Returns:
+        torch.Tensor: The dequantized weight.
+    """
+    scale = scale.to(dtype)
+    if out is None:
+        return q.to(dtype).mul_(scale)
+    return torch.mul(q, scale, out=out)
+
+
+def quantize_state_dict(state_dict: Dict[str, torch.Tensor], keys: Iterable[str]) -> Dict[str, torch.Tensor]:
+    """
+    Quantizes the given weights of a state_dict to int8. Each quantized weight <key> is stored
+    along with its scales <key>_scale, the other weights are kept as they are.
+
+    Args:
+        state_dict (Dict[str, torch.Tensor]): The state_dict to quantize.
+        keys (Iterable[str]): The keys of the linear weights to quantize.
+
+    Returns:
+        Dict[str, torch.Tensor]: The quantized state_dict.
+    """
+    state_dict = dict(state_dict)
+    for key in keys:
+        state_dict[key], state_dict[key + QUANT_SCALE_SUFFIX] = quantize_int8(state_dict[key])
+    return state_dict
+
+
+class Int8WoQLinear(nn.Module):
+    """
+    A linear layer with int8 weight-only quantization for cpu. The weight is kept in int8 with per-output-channel
+    scales (as produced by `quantize_int8`), and the activations stay in their floating point dtype. The fused
+    `torch._weight_int8pack_mm` kernel converts the weight on the fly, so it reads 4x fewer weight bytes than a
+    float32 `nn.Linear`, which bounds the speed of single-batch decoding.
+
+    This layer requires the kernel (`HAS_INT8PACK_MM`, torch >= 2.3) and cpu tensors. Elsewhere, use `nn.Linear`
+    and dequantize the weights when they are loaded, since dequantizing at every call would read more bytes.
+
+    The weight and scales are stored in the `weight` and `weight_scale` buffers, so their state_dict keys
+    match the keys of quantized split files.
+
+    Args:
+        in_features (int): The size of each input sample.
+        out_features (int): The size of each output sample.
+        bias (bool, optional): Whether to add a learnable bias. Defaults to True.
+    """
+
+    def __init__(self, in_features: int, out_features: int, bias: bool = True):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer("weight", torch.empty(out_features, in_features, dtype=torch.int8))
+        self.register_buffer("weight" + QUANT_SCALE_SUFFIX, torch.empty(out_features, 1, dtype=torch.float16))
+        self.bias = nn.Parameter(torch.empty(out_features)) if bias else None
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        scale = self.weight_scale.view(-1).to(x.dtype)
+        output = torch._weight_int8pack_mm(x.reshape(-1, self.in_features), self.weight, scale)
+        output = output.view(*x.shape[:-1], self.out_features)
+        if self.bias is not None:
+            output = output + self.bias.to(x.dtype)
+        return output
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}"
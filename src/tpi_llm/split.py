@@ -1,13 +1,18 @@
 import os
 import re
 import json
+import struct
 import shutil
 import torch
 import numpy as np
 import safetensors.torch
+import zstandard as zstd
 from tqdm import tqdm
 from collections import defaultdict
+from contextlib import ExitStack
+from safetensors import safe_open
 from .modeling_utils import load_model_config
+from .quantization import quantize_state_dict
 from .utils import (
     WEIGHTS_NAME,
     WEIGHTS_INDEX_NAME,
@@ -24,6 +29,8 @@ from .utils import (
     INPUT_EMB_KEY,
     OUTPUT_LAYERNORM_KEY,
     OUTPUT_HEAD_KEY,
+    COMPRESSED_SUFFIX,
+    QUANT_SCALE_SUFFIX,
 )
 
 
@@ -85,6 +92,24 @@ def get_heads_per_node(world_size, ratio, num_heads=None, num_kv_heads=None):
     return heads_per_node, kv_heads_per_node
 
 
+def get_vocab_range(vocab_size, world_size, rank):
+    """
+    Calculate the range of vocabulary rows of the output head held by a node. The vocabulary is split
+    into equal chunks, of which the last one may be shorter.
+
+    Args:
+        vocab_size (int): The size of the vocabulary.
+        world_size (int): The number of nodes.
+        rank (int): The rank of the node.
+
+    Returns:
+        tuple of int: The start (inclusive) and end (exclusive) of the vocabulary range of the node.
+    """
+    chunk_size = (vocab_size + world_size - 1) // world_size
+    start = min(rank * chunk_size, vocab_size)
+    return start, min(start + chunk_size, vocab_size)
+
+
 def validate_ratio(ratio, world_size):
     """
     Validate the given ratio.
@@ -147,7 +172,263 @@ def merge_and_load_weights(sharded_filenames, is_safetensors):
     return merged_weights
 
 
-def split_attention_heads(weights, layer_num, heads_per_node, kv_heads_per_node, head_dim, model_path, save_dir="split"):
+def save_state_dict(state_dict, save_path, compress=False):
+    """
+    Saves a state_dict of split weights in the SafeTensors format, which can be memory-mapped
+    during loading.
+
+    Parameters:
+    - state_dict: A dictionary of tensors to be saved.
+    - save_path: The path of the file to save to.
+    - compress: Whether to compress the file with Zstd, which is saved to <save_path>.zst. This trades
+      decompression time for fewer bytes read from slow disks. Default is False.
+    """
+    state_dict = {key: tensor.contiguous() for key, tensor in state_dict.items()}
+    if compress:
+        compressor = zstd.ZstdCompressor(level=3, threads=-1)
+        with open(save_path + COMPRESSED_SUFFIX, "wb") as f:
+            f.write(compressor.compress(safetensors.torch.save(state_dict)))
+    else:
+        safetensors.torch.save_file(state_dict, save_path)
+
+
+def convert_split_to_safetensors(split_dir):
+    """
+    Converts split weight files saved by `torch.save` (*.bin) into the SafeTensors format in place.
+    Split files produced by earlier versions are pickled, which have to be fully deserialized on every
+    load, while SafeTensors files are memory-mapped and only the requested tensors are read.
+
+    Parameters:
+    - split_dir: The directory containing the split weight files of a node.
+    """
+    if not os.path.isdir(split_dir):
+        return
+
+    for filename in os.listdir(split_dir):
+        if not filename.endswith(".bin"):
+            continue
+        bin_path = os.path.join(split_dir, filename)
+        state_dict = torch.load(bin_path, map_location="cpu")
+        save_state_dict(state_dict, os.path.splitext(bin_path)[0] + ".safetensors")
+        os.remove(bin_path)
+
+
+def _read_weight_file_header(file_path):
+    """
+    Reads the header of a SafeTensors file, which may be Zstd compressed, without reading the tensors.
+
+    Parameters:
+    - file_path: The path of the SafeTensors file.
+
+    Returns:
+    - dict: The dtype, shape and offsets of each tensor in the file, keyed by tensor key.
+    """
+    with open(file_path, "rb") as f:
+        reader = zstd.ZstdDecompressor().stream_reader(f) if file_path.endswith(COMPRESSED_SUFFIX) else f
+        header_size = struct.unpack("<Q", reader.read(8))[0]
+        header = b""
+        while len(header) < header_size:
+            chunk = reader.read(header_size - len(header))
+            if not chunk:
+                break
+            header += chunk
+    header = json.loads(header)
+    header.pop("__metadata__", None)
+    return header
+
+
+def _read_weight_file_keys(file_path):
+    """
+    Reads the tensor keys from the header of a SafeTensors file, which may be Zstd compressed,
+    without reading the tensors.
+
+    Parameters:
+    - file_path: The path of the SafeTensors file.
+
+    Returns:
+    - set: The tensor keys in the file.
+    """
+    return set(_read_weight_file_header(file_path).keys())
+
+
+def validate_output_split(output_path, vocab_size, world_size, rank):
+    """
+    Checks that the output weight file of a node holds the vocabulary slice of the output head of this node.
+    Splits made by earlier versions only saved the full output head on the master node.
+
+    Parameters:
+    - output_path: The path of the output weight file of the node.
+    - vocab_size: The size of the vocabulary.
+    - world_size: The number of nodes.
+    - rank: The rank of the node.
+
+    Raises:
+    - ValueError: If the output weight file is missing, or its output head is not the slice of this node.
+    """
+    if not os.path.exists(output_path):
+        raise ValueError(f"Output weight file {output_path} not found, the split files were made by an earlier "
+                         "version that did not split the output head across nodes. Split the model again.")
+
+    vocab_start, vocab_end = get_vocab_range(vocab_size, world_size, rank)
+    header = _read_weight_file_header(output_path)
+    if OUTPUT_HEAD_KEY in header and header[OUTPUT_HEAD_KEY]["shape"][0] != vocab_end - vocab_start:
+        raise ValueError(f"Output head in {output_path} has {header[OUTPUT_HEAD_KEY]['shape'][0]} rows, but "
+                         f"{vocab_end - vocab_start} are expected for node {rank} of {world_size}. "
+                         "Split the model again.")
+
+
+def fuse_gate_up_projections(split_dir):
+    """
+    Fuses the separate gate_proj and up_proj weights in MLP split files produced by earlier versions
+    into a single gate_up_proj weight in place, as expected by TPILlamaMLP.
+
+    Parameters:
+    - split_dir: The directory containing the split weight files of a node.
+    """
+    if not os.path.isdir(split_dir):
+        return
+
+    mlp_file_pattern = re.compile(re.escape(MLP_SAVE_PATH).replace(r"\{l\}", r"(\d+)")
+                                  + "(" + re.escape(COMPRESSED_SUFFIX) + ")?")
+    for filename in os.listdir(split_dir):
+        match = mlp_file_pattern.fullmatch(filename)
+        if match is None:
+            continue
+        layer_num, compressed = int(match.group(1)), match.group(2) is not None
+        file_path = os.path.join(split_dir, filename)
+        gate_key = MLP_KEY_TEMPLATE.format(l=layer_num, type="gate")
+        up_key = MLP_KEY_TEMPLATE.format(l=layer_num, type="up")
+        gate_up_key = MLP_KEY_TEMPLATE.format(l=layer_num, type="gate_up")
+        if gate_key not in _read_weight_file_keys(file_path):
+            continue
+
+        if compressed:
+            with open(file_path, "rb") as f:
+                state_dict = safetensors.torch.load(zstd.ZstdDecompressor().stream_reader(f).read())
+        else:
+            state_dict = safetensors.torch.load_file(file_path)
+        for suffix in ("", QUANT_SCALE_SUFFIX):
+            if gate_key + suffix in state_dict:
+                state_dict[gate_up_key + suffix] = torch.cat(
+                    [state_dict.pop(gate_key + suffix), state_dict.pop(up_key + suffix)], dim=0)
+        save_path = file_path[:-len(COMPRESSED_SUFFIX)] if compressed else file_path
+        save_state_dict(state_dict, save_path, compressed)
+
+
+def _get_split_range(split_dims, rank):
+    """
+    Returns the [start, end) range of the given node along a dimension split by split_dims.
+    """
+    start = sum(split_dims[:rank])
+    return start, start + split_dims[rank]
+
+
+def _get_mlp_split_dims(heads_per_node, intermediate_size):
+    """
+    Returns the sizes of the MLP intermediate dimension allocated to each node, in proportion to heads_per_node.
+    """
+    split_dims = (np.array(heads_per_node) * intermediate_size // sum(heads_per_node)).tolist()
+    assert sum(split_dims) == intermediate_size
+    return split_dims
+
+
+def _get_weight_getters(weights):
+    """
+    Returns the tensor, row and column getters over an in-memory weights dictionary. The slices are
+    cloned so that the saved tensors do not share storage with the full weights.
+    """
+    def _get_tensor(key):
+        return weights[key]
+
+    def _get_rows(key, start, end):
+        return weights[key][start:end].clone()
+
+    def _get_cols(key, start, end):
+        return weights[key][:, start:end].clone()
+
+    return _get_tensor, _get_rows, _get_cols
+
+
+def _build_attention_state_dict(
+    layer_num, heads_range, kv_heads_range, keys, get_tensor, get_rows, get_cols, quantize=False
+):
+    """
+    Builds the state_dict of the attention block of a node for a given layer.
+
+    Parameters:
+    - layer_num: The specific layer number to process.
+    - heads_range: The (start, end) rows of Q and columns of O allocated to the node.
+    - kv_heads_range: The (start, end) rows of K and V allocated to the node.
+    - keys: The keys of all available weights.
+    - get_tensor: A function that returns the full tensor of a key.
+    - get_rows: A function that returns the rows [start, end) of the tensor of a key.
+    - get_cols: A function that returns the columns [start, end) of the tensor of a key.
+    - quantize: Whether to quantize the linear weights to int8 with per-channel scales. Default is False.
+    """
+    input_layernorm_key = LAYERNORM_KEY_TEMPLATE.format(l=layer_num, type="input")
+    rotary_emb_key = ROTARY_EMB_KEY_TEMPLATE.format(l=layer_num)
+    q_key, k_key, v_key, o_key = [QKVO_KEY_TEMPLATE.format(l=layer_num, type=t) for t in "qkvo"]
+    state_dict = {
+        input_layernorm_key: get_tensor(input_layernorm_key),
+        q_key: get_rows(q_key, *heads_range),
+        k_key: get_rows(k_key, *kv_heads_range),
+        v_key: get_rows(v_key, *kv_heads_range),
+        o_key: get_cols(o_key, *heads_range),
+    }
+    if rotary_emb_key in keys:
+        state_dict[rotary_emb_key] = get_tensor(rotary_emb_key)
+    if quantize:
+        state_dict = quantize_state_dict(state_dict, [q_key, k_key, v_key, o_key])
+    return state_dict
+
+
+def _build_mlp_state_dict(layer_num, mlp_range, get_tensor, get_rows, get_cols, quantize=False):
+    """
+    Builds the state_dict of the MLP block of a node for a given layer. The gate_proj and up_proj
+    slices are concatenated into a single gate_up_proj weight.
+
+    Parameters:
+    - layer_num: The specific layer number to process.
+    - mlp_range: The (start, end) rows of gate_proj and up_proj, and columns of down_proj allocated to the node.
+    - get_tensor: A function that returns the full tensor of a key.
+    - get_rows: A function that returns the rows [start, end) of the tensor of a key.
+    - get_cols: A function that returns the columns [start, end) of the tensor of a key.
+    - quantize: Whether to quantize the linear weights to int8 with per-channel scales. Default is False.
+    """
+    post_attn_layernorm_key = LAYERNORM_KEY_TEMPLATE.format(l=layer_num, type="post_attention")
+    gate_key, up_key, down_key, gate_up_key = [
+        MLP_KEY_TEMPLATE.format(l=layer_num, type=t) for t in ("gate", "up", "down", "gate_up")]
+    state_dict = {
+        post_attn_layernorm_key: get_tensor(post_attn_layernorm_key),
+        gate_up_key: torch.cat([get_rows(gate_key, *mlp_range), get_rows(up_key, *mlp_range)], dim=0),
+        down_key: get_cols(down_key, *mlp_range),
+    }
+    if quantize:
+        state_dict = quantize_state_dict(state_dict, [gate_up_key, down_key])
+    return state_dict
+
+
+def _build_output_state_dict(head_key, vocab_range, get_tensor, get_rows):
+    """
+    Builds the state_dict of the output layer of a node, holding the output layernorm and the
+    vocabulary slice of the head.
+
+    Parameters:
+    - head_key: The key of the head weights, which is the input embedding for tied word embeddings.
+    - vocab_range: The (start, end) rows of the head allocated to the node.
+    - get_tensor: A function that returns the full tensor of a key.
+    - get_rows: A function that returns the rows [start, end) of the tensor of a key.
+    """
+    return {
+        OUTPUT_LAYERNORM_KEY: get_tensor(OUTPUT_LAYERNORM_KEY),
+        OUTPUT_HEAD_KEY: get_rows(head_key, *vocab_range),
+    }
+
+
+def split_attention_heads(
+    weights, layer_num, heads_per_node, kv_heads_per_node, head_dim, model_path, save_dir="split",
+    compress=False, quantize=False
+):
     """
     Splits the attention head weights (Q, K, V, O) for a given layer and saves them into separate files
     based on the specified heads_per_node distribution.
@@ -160,44 +441,29 @@ def split_attention_heads(weights, layer_num, heads_per_node, kv_heads_per_node,
     - head_dim: The dimension size of each attention head.
     - model_path: The path to the directory where the model files are stored.
     - save_dir: The subdirectory under model_path where the split weights will be saved. Default is "split".
+    - compress: Whether to compress the split weight files with Zstd. Default is False.
+    - quantize: Whether to quantize the linear weights to int8 with per-channel scales. Default is False.
     """
-    # get weight keys for the current layer
-    input_layernorm_key = LAYERNORM_KEY_TEMPLATE.format(l=layer_num, type="input")
-    rotary_emb_key = ROTARY_EMB_KEY_TEMPLATE.format(l=layer_num)
-    q_key = QKVO_KEY_TEMPLATE.format(l=layer_num, type="q")
-    k_key = QKVO_KEY_TEMPLATE.format(l=layer_num, type="k")
-    v_key = QKVO_KEY_TEMPLATE.format(l=layer_num, type="v")
-    o_key = QKVO_KEY_TEMPLATE.format(l=layer_num, type="o")
-
-    # split Q, K, V, O according to heads_per_node
     split_dims = (np.array(heads_per_node) * head_dim).tolist()
     split_dims_kv = (np.array(kv_heads_per_node) * head_dim).tolist()
-    q_slices = weights[q_key].split(split_dims, dim=0)
-    k_slices = weights[k_key].split(split_dims_kv, dim=0)
-    v_slices = weights[v_key].split(split_dims_kv, dim=0)
-    o_slices = weights[o_key].split(split_dims, dim=1)
-
-    # save q_slices, k_slices, v_slices, o_slices to <save_dir>. For example, for node 1, layer 1,
-    # and tensor q, k, v, o, the saved file should be <save_dir>/node_1/l1.qkvo.bin.
-    for node_rank, (q_, k_, v_, o_) in enumerate(zip(q_slices, k_slices, v_slices, o_slices)):
+    getters = _get_weight_getters(weights)
+
+    # save the slices of q, k, v, o to <save_dir>. For example, for node 1, layer 1,
+    # the saved file should be <save_dir>/node_1/l1.self_attn.safetensors.
+    for node_rank in range(len(heads_per_node)):
         node_dir = os.path.join(model_path, save_dir, f"node_{node_rank}")
         os.makedirs(node_dir, exist_ok=True)
-
-        # save q, k, v, o, rotary embedding, and input layernorm
-        attn_path = os.path.join(node_dir, ATTN_SAVE_PATH.format(l=layer_num))
-        state_dict = {
-            input_layernorm_key: weights[input_layernorm_key],
-            q_key: q_.clone(), k_key: k_.clone(), v_key: v_.clone(), o_key: o_.clone(),
-        }
-        if rotary_emb_key in weights.keys():
-            state_dict[rotary_emb_key] = weights[rotary_emb_key]
-        torch.save(state_dict, attn_path)
+        state_dict = _build_attention_state_dict(
+            layer_num, _get_split_range(split_dims, node_rank), _get_split_range(split_dims_kv, node_rank),
+            weights.keys(), *getters, quantize=quantize)
+        save_state_dict(state_dict, os.path.join(node_dir, ATTN_SAVE_PATH.format(l=layer_num)), compress)
 
 
-def split_mlp(weights, layer_num, heads_per_node, model_path, save_dir="split"):
+def split_mlp(weights, layer_num, heads_per_node, model_path, save_dir="split", compress=False, quantize=False):
     """
     Splits the MLP weights (gate_proj, down_proj, up_proj) for a given Transformer layer
     and saves them into separate files based on the specified heads_per_node distribution.
+    The gate_proj and up_proj slices are concatenated into a single gate_up_proj weight.
 
     Parameters:
     - weights: The full model weights dictionary containing all layers.
@@ -205,65 +471,57 @@ def split_mlp(weights, layer_num, heads_per_node, model_path, save_dir="split"):
     - heads_per_node: A list specifying the number of attention heads allocated to each node.
     - model_path: The path to the directory where the model files are stored.
     - save_dir: The subdirectory under model_path where the split weights will be saved. Default is "split".
+    - compress: Whether to compress the split weight files with Zstd. Default is False.
+    - quantize: Whether to quantize the linear weights to int8 with per-channel scales. Default is False.
     """
-    # get weight keys for the current layer
-    post_attn_layernorm_key = LAYERNORM_KEY_TEMPLATE.format(l=layer_num, type="post_attention")
     gate_key = MLP_KEY_TEMPLATE.format(l=layer_num, type="gate")
-    up_key = MLP_KEY_TEMPLATE.format(l=layer_num, type="up")
-    down_key = MLP_KEY_TEMPLATE.format(l=layer_num, type="down")
-
-    # calculate the dimensions to split the weights according to heads_per_node
-    split_dims = (np.array(heads_per_node) * weights[gate_key].size(0) // sum(heads_per_node)).tolist()
-    assert sum(split_dims) == weights[gate_key].size(0)
+    split_dims = _get_mlp_split_dims(heads_per_node, weights[gate_key].size(0))
+    getters = _get_weight_getters(weights)
 
-    # split gate_proj, up_proj, down_proj based on split_dims
-    gate_slices = weights[gate_key].split(split_dims, dim=0)
-    up_slices = weights[up_key].split(split_dims, dim=0)
-    down_slices = weights[down_key].split(split_dims, dim=1)
-
-    # save gate_slices, up_slices, down_slices to <save_dir>. For example, for node 1, layer 1,
-    # and tensor gate_proj, up_proj, down_proj, the saved file should be <save_dir>/node_1/l1.mlp.bin.
-    for node_rank, (gate_, up_, down_) in enumerate(zip(gate_slices, up_slices, down_slices)):
+    # save the slices of gate_up_proj and down_proj to <save_dir>. For example, for node 1, layer 1,
+    # the saved file should be <save_dir>/node_1/l1.mlp.safetensors.
+    for node_rank in range(len(heads_per_node)):
         node_dir = os.path.join(model_path, save_dir, f"node_{node_rank}")
         os.makedirs(node_dir, exist_ok=True)
-        mlp_path = os.path.join(node_dir, MLP_SAVE_PATH.format(l=layer_num))
-        torch.save({
-            post_attn_layernorm_key: weights[post_attn_layernorm_key],
-            gate_key: gate_.clone(),
-            up_key: up_.clone(),
-            down_key: down_.clone(),
-        }, mlp_path)
+        state_dict = _build_mlp_state_dict(
+            layer_num, _get_split_range(split_dims, node_rank), *getters, quantize=quantize)
+        save_state_dict(state_dict, os.path.join(node_dir, MLP_SAVE_PATH.format(l=layer_num)), compress)
 
 
-def save_input_and_output_weights(weights, model_path, save_dir="split"):
+def save_input_and_output_weights(weights, model_path, world_size, save_dir="split", compress=False):
     """
-    This function is useful for saving the input embedding, output layernorm, and output head to
-    the master node.
+    This function is useful for saving the input embedding to the master node, and the output layernorm
+    and the vocabulary slices of the output head to all nodes.
 
     Parameters:
     - weights: The full model weights dictionary containing all layers.
     - model_path: The path to the directory where the model files are stored.
+    - world_size: The number of nodes to split the output head across.
     - save_dir: The subdirectory under model_path where the non-split weights will be saved. Default is "split".
+    - compress: Whether to compress the weight files with Zstd. Default is False.
     """
-    # save input embedding and output layernorm, head on the master node.
+    # save input embedding on the master node.
     node_dir = os.path.join(model_path, save_dir, "node_0")
     os.makedirs(node_dir, exist_ok=True)
-
-    # save input embedding
     if INPUT_EMB_KEY in weights.keys():
         save_path = os.path.join(node_dir, INPUT_SAVE_PATH)
-        torch.save({INPUT_EMB_KEY: weights[INPUT_EMB_KEY]}, save_path)
-
-    # save output layernorm and head
-    if {OUTPUT_LAYERNORM_KEY, OUTPUT_HEAD_KEY}.issubset(set(weights.keys())):
-        save_path = os.path.join(node_dir, OUTPUT_SAVE_PATH)
-        torch.save({
-            OUTPUT_LAYERNORM_KEY: weights[OUTPUT_LAYERNORM_KEY],
-            OUTPUT_HEAD_KEY: weights[OUTPUT_HEAD_KEY],
-        }, save_path)
-
-
-def split_pretrained_model(model_path, world_size, ratio, save_dir="split"):
+        save_state_dict({INPUT_EMB_KEY: weights[INPUT_EMB_KEY]}, save_path, compress)
+
+    # save output layernorm and the vocabulary slice of the head on each node. models with tied word
+    # embeddings have no head weights, and share the input embedding weights instead.
+    head_key = OUTPUT_HEAD_KEY if OUTPUT_HEAD_KEY in weights.keys() else INPUT_EMB_KEY
+    if {OUTPUT_LAYERNORM_KEY, head_key}.issubset(set(weights.keys())):
+        get_tensor, get_rows, _ = _get_weight_getters(weights)
+        vocab_size = weights[head_key].shape[0]
+        for rank in range(world_size):
+            node_dir = os.path.join(model_path, save_dir, f"node_{rank}")
+            os.makedirs(node_dir, exist_ok=True)
+            state_dict = _build_output_state_dict(
+                head_key, get_vocab_range(vocab_size, world_size, rank), get_tensor, get_rows)
+            save_state_dict(state_dict, os.path.join(node_dir, OUTPUT_SAVE_PATH), compress)
+
+
+def split_pretrained_model(model_path, world_size, ratio, save_dir="split", compress=False, quantize=False):
     """
     Splits the pretrained model parameters based on the specified ratio.
 
@@ -272,6 +530,8 @@ def split_pretrained_model(model_path, world_size, ratio, save_dir="split"):
     - world_size (int): Number of nodes to distribute the attention heads across.
     - ratio (list of float): A list specifying the ratio of attention heads to distribute across nodes.
     - save_dir: The subdirectory under model_path where the split weights will be saved. Default is "split".
+    - compress: Whether to compress the split weight files with Zstd. Default is False.
+    - quantize: Whether to quantize the linear weights of transformer layers to int8. Default is False.
     """
     # Check if save_dir already exists, and delete it if it does
     shutil.rmtree(os.path.join(model_path, save_dir), ignore_errors=True)
@@ -311,10 +571,101 @@ def split_pretrained_model(model_path, world_size, ratio, save_dir="split"):
     else:
         raise NotImplementedError("Current weight files are not supported.")
 
-    # save input and output layer on the master node
-    save_input_and_output_weights(full_weights, model_path, save_dir)
+    # save input layer on the master node, and output layer on each node
+    save_input_and_output_weights(full_weights, model_path, world_size, save_dir, compress)
     # split and save attention and mlp layers on each node
     for layer_num in tqdm(range(num_hidden_layers), desc="Slicing layer", leave=False):
         split_attention_heads(
-            full_weights, layer_num, heads_per_node, kv_heads_per_node, head_dim, model_path, save_dir)
-        split_mlp(full_weights, layer_num, heads_per_node, model_path, save_dir)
+            full_weights, layer_num, heads_per_node, kv_heads_per_node, head_dim, model_path, save_dir,
+            compress, quantize)
+        split_mlp(full_weights, layer_num, heads_per_node, model_path, save_dir, compress, quantize)
+
+
+def split_pretrained_model_for_node(
+    model_path, world_size, ratio, rank, save_dir="split", compress=False, quantize=False
+):
+    """
+    Splits the pretrained model parameters for the given node only. Instead of loading the full weights,
+    only the slices of this node are read from the SafeTensors files, so that all nodes can split the
+    model in parallel from a shared file system.
+
+    Parameters:
+    - model_path (str): Path to the directory containing the model files.
+    - world_size (int): Number of nodes to distribute the attention heads across.
+    - ratio (list of float): A list specifying the ratio of attention heads to distribute across nodes.
+    - rank (int): The rank of the node to split the model parameters for.
+    - save_dir: The subdirectory under model_path where the split weights will be saved. Default is "split".
+    - compress: Whether to compress the split weight files with Zstd. Default is False.
+    - quantize: Whether to quantize the linear weights of transformer layers to int8. Default is False.
+    """
+    # only delete the split weights of this node, other nodes may be writing theirs
+    node_dir = os.path.join(model_path, save_dir, f"node_{rank}")
+    shutil.rmtree(node_dir, ignore_errors=True)
+    os.makedirs(node_dir)
+
+    # load model configuration.
+    config = load_model_config(model_path)
+    num_hidden_layers = config["num_hidden_layers"]
+    num_heads = config["num_attention_heads"]
+    num_kv_heads = config.get("num_key_value_heads", num_heads)
+    hidden_size = config["hidden_size"]
+    intermediate_size = config["intermediate_size"]
+    head_dim = hidden_size // num_heads
+
+    # allocate attention heads according to ratio, and get the range of this node.
+    heads_per_node, kv_heads_per_node = get_heads_per_node(
+        world_size, ratio, num_heads=num_heads, num_kv_heads=num_kv_heads)
+    heads_range = _get_split_range((np.array(heads_per_node) * head_dim).tolist(), rank)
+    kv_heads_range = _get_split_range((np.array(kv_heads_per_node) * head_dim).tolist(), rank)
+    mlp_range = _get_split_range(_get_mlp_split_dims(heads_per_node, intermediate_size), rank)
+
+    # map weight keys to the SafeTensors files holding them
+    safetensors_file = os.path.join(model_path, SAFE_WEIGHTS_NAME)
+    safetensors_index_file = os.path.join(model_path, SAFE_WEIGHTS_INDEX_NAME)
+    if os.path.exists(safetensors_file):
+        with safe_open(safetensors_file, framework="pt", device="cpu") as f:
+            weight_map = {key: safetensors_file for key in f.keys()}
+    elif os.path.exists(safetensors_index_file):
+        with open(safetensors_index_file, "r") as f:
+            index = json.loads(f.read())
+        weight_map = {key: os.path.join(model_path, fn) for key, fn in index["weight_map"].items()}
+    else:
+        raise NotImplementedError("Splitting the model on each node requires weight files in the SafeTensors format.")
+
+    with ExitStack() as stack:
+        handles = {
+            fn: stack.enter_context(safe_open(fn, framework="pt", device="cpu"))
+            for fn in set(weight_map.values())
+        }
+
+        def _get_tensor(key):
+            return handles[weight_map[key]].get_tensor(key)
+
+        def _get_rows(key, start, end):
+            return handles[weight_map[key]].get_slice(key)[start:end]
+
+        def _get_cols(key, start, end):
+            return handles[weight_map[key]].get_slice(key)[:, start:end]
+
+        # save input layer on the master node
+        if rank == 0 and INPUT_EMB_KEY in weight_map:
+            save_state_dict({INPUT_EMB_KEY: _get_tensor(INPUT_EMB_KEY)}, os.path.join(node_dir, INPUT_SAVE_PATH),
+                            compress)
+
+        # save output layernorm and the vocabulary slice of the head of this node. models with tied word
+        # embeddings have no head weights, and share the input embedding weights instead.
+        head_key = OUTPUT_HEAD_KEY if OUTPUT_HEAD_KEY in weight_map else INPUT_EMB_KEY
+        if {OUTPUT_LAYERNORM_KEY, head_key}.issubset(weight_map.keys()):
+            vocab_range = get_vocab_range(
+                handles[weight_map[head_key]].get_slice(head_key).get_shape()[0], world_size, rank)
+            state_dict = _build_output_state_dict(head_key, vocab_range, _get_tensor, _get_rows)
+            save_state_dict(state_dict, os.path.join(node_dir, OUTPUT_SAVE_PATH), compress)
+
+        # read and save the slices of attention and mlp layers of this node
+        getters = (_get_tensor, _get_rows, _get_cols)
+        for layer_num in tqdm(range(num_hidden_layers), desc="Slicing layer", leave=False):
+            state_dict = _build_attention_state_dict(
+                layer_num, heads_range, kv_heads_range, weight_map.keys(), *getters, quantize=quantize)
+            save_state_dict(state_dict, os.path.join(node_dir, ATTN_SAVE_PATH.format(l=layer_num)), compress)
+            state_dict = _build_mlp_state_dict(layer_num, mlp_range, *getters, quantize=quantize)
+            save_state_dict(state_dict, os.path.join(node_dir, MLP_SAVE_PATH.format(l=layer_num)), compress)
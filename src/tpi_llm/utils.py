@@ -21,10 +21,12 @@ MLP_KEY_TEMPLATE = TRANSFORMER_LAYER_KEY_PREFIX + ".{l}.mlp.{type}_proj.weight"
 ROTARY_EMB_KEY_TEMPLATE = TRANSFORMER_LAYER_KEY_PREFIX + ".{l}.self_attn.rotary_emb.inv_freq"
 LAYERNORM_KEY_TEMPLATE = TRANSFORMER_LAYER_KEY_PREFIX + ".{l}.{type}_layernorm.weight"
 BLOCK_TEMPLATE = "{type}.{l}"
-ATTN_SAVE_PATH = "l{l}.self_attn.bin"
-MLP_SAVE_PATH = "l{l}.mlp.bin"
-INPUT_SAVE_PATH = "input.bin"
-OUTPUT_SAVE_PATH = "output.bin"
+ATTN_SAVE_PATH = "l{l}.self_attn.safetensors"
+MLP_SAVE_PATH = "l{l}.mlp.safetensors"
+INPUT_SAVE_PATH = "input.safetensors"
+OUTPUT_SAVE_PATH = "output.safetensors"
+COMPRESSED_SUFFIX = ".zst"
+QUANT_SCALE_SUFFIX = "_scale"
 INPUT_EMB_KEY = "model.embed_tokens.weight"
 OUTPUT_LAYERNORM_KEY = "model.norm.weight"
 OUTPUT_HEAD_KEY = "lm_head.weight"